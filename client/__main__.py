@@ -1,13 +1,17 @@
-"""Entrypoint for the TUI client."""
+"""Entrypoint for the TUI client.
+
+Only what the menu needs is imported up front. The games, networking and
+pydantic models are imported when a game starts, and the server only when
+hosting one, so the menu comes up quickly.
+"""
 import json
 import os
 
 from blessed import Terminal
 
-from server import Server
+from common import transport
 
-from .game import OfflineGame, OnlineGame
-from .level import Window
+from .level import terminal
 
 
 class InputManager:
@@ -16,8 +20,7 @@ class InputManager:
     def __init__(self):
         """Initialize the class."""
         self.name = "Player69"
-        self.window = Window(os.get_terminal_size())
-        self.term = self.window.term
+        self.term = terminal()
         self.savefile = "save.json"
         self.savefile = os.path.join(
             os.path.dirname(__file__), self.savefile
@@ -25,6 +28,7 @@ class InputManager:
         self.nick_input = "Name (2-8 chars): "
         self.host = ""
         self.port = 0
+        self.lockstep = False
         self.load_class()
 
     def load_class(self):
@@ -41,13 +45,18 @@ class InputManager:
     def save_class(self):
         """Save variables for future load."""
         with open(self.savefile, "w") as f:
-            data = {"name": self.name, "host": self.host, "port": self.port}
+            data = {
+                "name": self.name,
+                "host": self.host,
+                "port": self.port,
+                "lockstep": self.lockstep,
+            }
             json.dump(data, f)
 
     def get_user_input(self, text: str, old_val: str = "") -> str:
         """Get user input text."""
-        x = self.window.width // 2  # center of screen
-        y = self.window.height // 2  # center of screen
+        x = self.term.width // 2  # center of screen
+        y = self.term.height // 2  # center of screen
         input = old_val
         print(end=self.term.home + self.term.clear)
         print(self.term.move_xy(x, y) + self.term.red_bold + text)
@@ -73,8 +82,8 @@ class InputManager:
 
     def change_nickname(self):
         """Change player name."""
-        x = self.window.width // 2  # center of screen
-        y = self.window.height // 2  # center of screen
+        x = self.term.width // 2  # center of screen
+        y = self.term.height // 2  # center of screen
         """Prompt for player to change their name."""
         self.name = self.get_user_input(self.nick_input, self.name)
         if len(self.name) > 8 or len(self.name) < 2:
@@ -86,16 +95,84 @@ class InputManager:
         print(self.term.normal)
         self.save_class()
 
-    def connect_to_game(self):
-        """Prompt server details."""
+    @property
+    def address(self) -> str:
+        """The server's address, from an ip and port or a full address."""
+        if "://" in self.host:
+            return self.host  # Like unix:///tmp/snake.sock.
+        return transport.tcp_address(self.host, self.port)
+
+    def ask_server_details(self):
+        """Prompt server details, if we don't have them yet."""
         if not self.host:
-            self.host = self.get_user_input("Server ip: ")
+            self.host = self.get_user_input("Server ip or address: ")
+            if "://" in self.host:
+                self.save_class()
+                return
             try:
                 self.port = int(self.get_user_input("Port (65444): "))
             except ValueError:
                 self.port = 65444
             self.save_class()
-        OnlineGame(self.host, self.port, self.name)
+
+    def play_offline(self):
+        """Play a game on our own."""
+        from .game import OfflineGame
+
+        OfflineGame()
+
+    def connect_to_game(self):
+        """Prompt server details."""
+        from .game import OnlineGame
+
+        self.ask_server_details()
+        OnlineGame(self.address, self.name, self.lockstep)
+
+    def toggle_lockstep(self):
+        """Switch between being sent frames and simulating the game locally."""
+        self.lockstep = not self.lockstep
+        self.save_class()
+        x = self.term.width // 2  # center of screen
+        y = self.term.height // 2  # center of screen
+        message = f"Lockstep mode {'on' if self.lockstep else 'off'}"
+        print(end=self.term.home + self.term.clear)
+        print(
+            self.term.move_xy(x - len(message) // 2, y)
+            + self.term.red_bold
+            + message
+            + self.term.normal
+        )
+        self.term.inkey()
+
+    def show_leaderboard(self):
+        """Show the server's high score table."""
+        from .networking import Connection
+
+        self.ask_server_details()
+        con = Connection()
+        try:
+            con.connect(self.address, hello=False)
+            data = con.query_leaderboard(self.name)
+        except (OSError, ConnectionError):
+            lines = ["Could not reach the server."]
+        else:
+            lines = ["HIGH SCORES", ""]
+            for place, (name, score) in enumerate(data["top"], start=1):
+                lines.append(f"{place:>2}. {name:<8} {score:>6}")
+            if data["rank"] is not None:
+                lines += ["", f"You are #{data['rank']}"]
+
+        x = self.term.width // 2  # center of screen
+        y = (self.term.height - len(lines)) // 2
+        print(end=self.term.home + self.term.clear)
+        for index, line in enumerate(lines):
+            print(
+                self.term.move_xy(x - len(line) // 2, y + index)
+                + self.term.red_bold
+                + line
+                + self.term.normal
+            )
+        self.term.inkey()
 
     def reset_server(self):
         """Reset server details."""
@@ -105,25 +182,31 @@ class InputManager:
 
     def start_server(self):
         """Input config params and start server."""
+        from server import Server
+        from server.config import DEFAULTS
+
         name = self.get_user_input("Server Name: ", "SnekBox")
         server_port = int(self.get_user_input("Port (65444): ", str(65444)))
         server_y = self.get_user_input("Height: ", str(32))
         server_x = self.get_user_input("Width: ", str(128))
         tick = int(self.get_user_input("Tickrate: ", str(15)))
         max = int(self.get_user_input("Max Players: ", str(5)))
+        profile = self.get_user_input("Profile ticks (y/n): ", "n") == "y"
 
         print(end=self.term.home + self.term.clear)
         print("Starting server...")
         print("PRESS Q TO QUIT")
-        config = {
-            "SERVER_NAME": name,
-            "GAME_VERSION": 0,
-            "BOX_WIDTH": server_x,
-            "BOX_HEIGHT": server_y,
-            "TICKRATE": tick,
-            "MAX_PLAYERS": max,
-        }
-        serv = Server(port=server_port, config=config)
+        print("PRESS P TO LOG TICK PROFILES")
+        config = dict(
+            DEFAULTS,
+            SERVER_NAME=name,
+            BOX_WIDTH=server_x,
+            BOX_HEIGHT=server_y,
+            TICKRATE=tick,
+            MAX_PLAYERS=max,
+            PROFILE=profile,
+        )
+        serv = Server(config, transport.tcp_address("", server_port))
         serv.start()
 
         while True:
@@ -133,26 +216,26 @@ class InputManager:
                 serv.stop()
                 serv.join()
                 break
-
-
-inmger = InputManager()
+            elif val == "p":
+                serv.dump_profiles()
 
 
 class Menu:
     """The main menu."""
 
-    OPTIONS = [
-        ["Start Offline", OfflineGame],
-        ["Connect to server", inmger.connect_to_game],
-        ["Reset Server Details", inmger.reset_server],
-        ["Change Nickname", inmger.change_nickname],
-        ["Host A Server", inmger.start_server],
-        ["Exit", exit],
-    ]
-
-    def __init__(self, term: Terminal):
+    def __init__(self, term: Terminal, inmger: InputManager):
         """Set up the menu."""
         self.term = term
+        self.OPTIONS = [
+            ["Start Offline", inmger.play_offline],
+            ["Connect to server", inmger.connect_to_game],
+            ["High Scores", inmger.show_leaderboard],
+            ["Reset Server Details", inmger.reset_server],
+            ["Change Nickname", inmger.change_nickname],
+            ["Toggle Lockstep Mode", inmger.toggle_lockstep],
+            ["Host A Server", inmger.start_server],
+            ["Exit", exit],
+        ]
         self.selection_index = 0
         self.draw()
         self.event_loop()
@@ -195,11 +278,10 @@ class Menu:
         """Wait for keypresses."""
         while True:
             with self.term.cbreak(), self.term.hidden_cursor():
-                key = window.term.inkey(timeout=1).name
+                key = self.term.inkey(timeout=1).name
                 if key:
                     self.on_key_press(key.removeprefix("KEY_").lower())
 
 
 if __name__ == "__main__":
-    window = Window(os.get_terminal_size())
-    Menu(window.term)
+    Menu(terminal(), InputManager())
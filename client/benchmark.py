@@ -0,0 +1,126 @@
+"""Measuring how fast the client starts.
+
+Each run starts the client in a fresh interpreter, so nothing is cached
+but what the OS caches. Two things are measured:
+
+ - How long importing the client's entrypoint takes, and whether it kept
+   the server, pydantic and the game models from being imported.
+ - How long it takes, from starting `python -m client` in a pseudo
+   terminal, until the menu is drawn. The pseudo terminal answers the
+   cursor position queries blessed sends, like a real terminal would.
+
+Pass --max-import or --max-menu (in milliseconds) to exit with an error
+when the median is slower, for catching regressions.
+"""
+import argparse
+import fcntl
+import os
+import select
+import statistics
+import struct
+import subprocess
+import sys
+import termios
+import time
+
+# Modules the menu shouldn't need.
+DEFERRED = ["server", "pydantic", "common.models", "client.game"]
+# Drawn by the menu, so seeing it means the first frame is out.
+MENU_TITLE = b"SNEK"
+CURSOR_QUERY = b"\x1b[6n"
+CURSOR_REPORT = b"\x1b[1;1R"
+TIMEOUT = 10.0
+
+IMPORT_SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+import client.__main__
+elapsed = time.perf_counter() - start
+loaded = [name for name in {DEFERRED!r} if name in sys.modules]
+print(elapsed, *loaded)
+"""
+
+
+def time_import() -> tuple[float, list[str]]:
+    """Time importing the entrypoint, and list deferred modules it loaded."""
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    return float(out[0]), out[1:]
+
+
+def time_menu() -> float:
+    """Time starting the client until its menu is drawn."""
+    master, slave = os.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", 40, 120, 0, 0))
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "client"],
+        stdin=slave,
+        stdout=slave,
+        stderr=slave,
+        start_new_session=True,
+        env={**os.environ, "TERM": os.environ.get("TERM", "xterm-256color")},
+    )
+    os.close(slave)
+    output = b""
+    try:
+        while MENU_TITLE not in output:
+            if time.perf_counter() - start > TIMEOUT:
+                raise TimeoutError("The menu wasn't drawn")
+            ready, _, _ = select.select([master], [], [], 0.1)
+            if not ready:
+                continue
+            data = os.read(master, 65536)
+            for _ in range(data.count(CURSOR_QUERY)):
+                os.write(master, CURSOR_REPORT)
+            output += data
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+        os.close(master)
+
+
+def report(name: str, samples: list[float], limit: float) -> bool:
+    """Print the times taken, returning whether the median was in time."""
+    median = statistics.median(samples) * 1000
+    print(
+        f"{name}: median {median:.0f} ms, "
+        f"min {min(samples) * 1000:.0f} ms, max {max(samples) * 1000:.0f} ms"
+    )
+    if limit and median > limit:
+        print(f"{name} is slower than {limit:.0f} ms")
+        return False
+    return True
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("--max-import", type=float, default=0)
+    parser.add_argument("--max-menu", type=float, default=0)
+    args = parser.parse_args()
+
+    imports = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed, modules = time_import()
+        imports.append(elapsed)
+        loaded.update(modules)
+    menus = [time_menu() for _ in range(args.runs)]
+
+    ok = report("Import", imports, args.max_import)
+    ok = report("Menu", menus, args.max_menu) and ok
+    if loaded:
+        print("Imported before the menu:", ", ".join(sorted(loaded)))
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 """Entrypoint for the Game."""
 import os
 import time
+from collections import deque
+
+from blessed.keyboard import Keystroke
 
 from common import logic
 
+from .glyphs import BLOCK_CHAR, SnakeGlyphs
 from .level import Window
 from .networking import Connection
+from .scheduler import Scheduler, Wakeup
 
-BLOCK_CHAR = "█"
 FPS = 15
+# Most frames drawn a second online, where frames come from the server.
+MAX_FPS = 60
+# Turns kept for the coming steps offline, so two quick key presses both
+# count without the second undoing the first.
+TURN_BUFFER = 2
 
 # The numbers are lower score boundaries for each verdicts.
 DEATH_VERDICTS = [
@@ -27,31 +36,6 @@ DEATH_VERDICTS = [
     (120, "Still pathetic lmao."),
 ]
 
-# N[orth]/E[ast]/S[outh]/[W]est indicates direction of segment to join on to.
-SNAKE_HEAD_CHARS = {
-    "n": "╹",
-    "e": "╺",
-    "s": "╻",
-    "w": "╸",
-}
-
-SNAKE_BODY_CHARS = {
-    "ew": "═",
-    "ns": "║",
-    "es": "╔",
-    "sw": "╗",
-    "ne": "╚",
-    "nw": "╝",
-    "ww": "═",
-}
-
-SNAKE_TAIL_CHARS = {
-    "n": "╿",
-    "e": "╼",
-    "s": "╽",
-    "w": "╾",
-}
-
 
 class Game:
     """The game mainloop."""
@@ -61,6 +45,15 @@ class Game:
         self.window = win
         self.term = Window.term
 
+    def show_message(self, message: str):
+        """Clear the screen and show a message in the middle."""
+        x = self.term.width // 2 - len(message) // 2
+        y = self.term.height // 2
+        print(end=self.term.home + self.term.clear)
+        print(
+            self.term.move_xy(x, y) + self.term.red + message + self.term.normal
+        )
+
     def get_death_message(self) -> str:
         """Get the message to show when the player dies."""
         for score, possible_verdict in DEATH_VERDICTS:
@@ -70,14 +63,7 @@ class Game:
 
     def show_death_screen(self):
         """Show when player dies."""
-        message = self.get_death_message()
-        # Calculate center.
-        x = self.term.width // 2 - len(message) // 2
-        y = self.term.height // 2
-        print(end=self.term.home + self.term.clear)
-        print(
-            self.term.move_xy(x, y) + self.term.red + message + self.term.normal
-        )
+        self.show_message(self.get_death_message())
 
 
 class OfflineGame(Game):
@@ -91,148 +77,177 @@ class OfflineGame(Game):
         self.segments = []
         self.score = 0
         self.apple = None
+        self.glyphs = SnakeGlyphs()
+        self.turns = deque(maxlen=TURN_BUFFER)  # Keys not acted on yet.
+        self.scheduler = Scheduler(
+            self.term,
+            FPS,
+            self.on_key,
+            self.step,
+            steady=True,
+            on_redraw=self.redraw,
+        )
 
         # Create the initial snake segments.
         for _ in range(logic.STARTING_SNAKE_SEGMENTS):
             logic.add_segment(self.segments)
-        with self.term.hidden_cursor():
-            self.run_game_loop()
-
-    def direction_from_segment(
-        self, from_segment_index: int, to_segment_index: int
-    ) -> str:
-        """Find the direction from one segment to another.
-
-        Assumes these segments are connected.
-        """
-        s_from = self.segments[from_segment_index]
-        s_to = self.segments[to_segment_index]
-        if s_from.x == s_to.x:
-            return "n" if s_to.y < s_from.y else "s"
-        else:
-            return "e" if s_to.x > s_from.x else "w"
+        self.run_game_loop()
 
     def draw(self):
-        """Draw the snake on the window."""
-        snake_chars = []
-        snake_chars.append(SNAKE_HEAD_CHARS[self.direction_from_segment(0, 1)])
-        for body_index in range(1, len(self.segments) - 1):
-            before_dir = self.direction_from_segment(body_index, body_index - 1)
-            after_dir = self.direction_from_segment(body_index, body_index + 1)
-            if before_dir + after_dir in SNAKE_BODY_CHARS:
-                snake_chars.append(SNAKE_BODY_CHARS[before_dir + after_dir])
-            else:
-                snake_chars.append(SNAKE_BODY_CHARS[after_dir + before_dir])
-        snake_chars.append(SNAKE_TAIL_CHARS[self.direction_from_segment(-1, -2)])
-        for segment, char in zip(self.segments, snake_chars):
-            print(
-                self.term.home
-                + self.term.move_xy(segment.x, segment.y)
-                + self.window.SNAKE_COLOR
-                + char
-                + self.term.normal
-                + self.term.home
+        """Draw the cells of the snake that changed since the last frame."""
+        changed, vacated = self.glyphs.update(
+            [(segment.x, segment.y) for segment in self.segments]
+        )
+        frame = [self.term.move_xy(x, y) + " " for x, y in vacated]
+        for x, y, char in changed:
+            frame.append(
+                self.term.move_xy(x, y) + self.window.SNAKE_COLOR + char
             )
-
-        print(
-            self.term.home
-            + self.term.move_xy(self.apple.x, self.apple.y)
+        frame.append(
+            self.term.move_xy(self.apple.x, self.apple.y)
             + self.term.red
             + BLOCK_CHAR
             + self.term.normal
             + self.term.home
         )
+        print(end="".join(frame), flush=True)
+
+    def redraw(self):
+        """Draw everything again, after something was drawn over it."""
+        self.window.draw_border()
+        self.glyphs = SnakeGlyphs()
 
     def run_game_loop(self):
         """Run the game update loop."""
-        last_frame_time = current_time = time.time()
         self.apple = logic.create_apple(self.window.size, self.segments)
-        while True:
-            # Calculations needed for maintaining stable FPS
-            sleep_time = 1 / FPS - (current_time - last_frame_time)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-
-            # Change direction if there is input.
-            with self.term.cbreak():
-                if key := self.term.inkey(timeout=0).name:
-                    self.direction = logic.change_direction(
-                        key.removeprefix("KEY_").lower(), self.direction
-                    )
-
-            # Render the screen.
-            self.window.draw_border()
-            self.draw()
-            # Move the snake.
-            logic.move(self.direction, self.segments)
-
-            # check for apple
-            if logic.check_apple(self.segments, self.apple):
-                self.apple = logic.create_apple(self.window.size, self.segments)
-                logic.add_segment(self.segments)
-                self.score += 1
-
-            # check for collisions
-            if logic.has_collided_with_self(
-                self.segments
-            ) or logic.has_collided_with_wall(
-                self.window.width, self.window.height, self.segments
-            ):
-                self.show_death_screen()
-                with self.term.cbreak():
-                    self.term.inkey()
-                    return
+        self.window.draw_border()
+        self.scheduler.run()
+
+        self.show_death_screen()
+        with self.term.cbreak():
+            self.term.inkey()
+
+    def on_key(self, key: Keystroke):
+        """Keep a key press for the next steps."""
+        if key.name:
+            self.turns.append(key.name.removeprefix("KEY_").lower())
+
+    def step(self):
+        """Draw the screen, then move the game on by one step."""
+        # Change direction if there is input.
+        if self.turns:
+            self.direction = logic.change_direction(
+                self.turns.popleft(), self.direction
+            )
+
+        # Render the screen.
+        self.draw()
+        # Move the snake.
+        logic.move(self.direction, self.segments)
+
+        # check for apple
+        if logic.check_apple(self.segments, self.apple):
+            self.apple = logic.create_apple(self.window.size, self.segments)
+            logic.add_segment(self.segments)
+            self.score += 1
+
+        # check for collisions
+        if logic.has_collided_with_self(
+            self.segments
+        ) or logic.has_collided_with_wall(
+            self.window.width, self.window.height, self.segments
+        ):
+            self.scheduler.stop()
 
 
 class OnlineGame(Game):
     """Online Game Mode controller."""
 
-    def __init__(self, host: str, port: int, name: str):
+    def __init__(self, address: str, name: str, lockstep: bool = False):
         """Online Game class."""
-        self.con = Connection()
+        self.con = Connection(lockstep)
         self.name = name
         self.score = 0
         self.alive = True
         self.direction = (1, 0)
-        self.con.connect(host, port)
+        self.snakes = {}
+        self.players = []  # The latest ranking from the server.
+        self.window = Window(os.get_terminal_size())
+        self.term = self.window.term
+        self.clear = True  # Whether the next frame clears the screen.
+        # The connection wakes the scheduler when it has data for us.
+        self.wakeup = Wakeup()
+        self.con.on_data = self.wakeup.set
+        self.scheduler = Scheduler(
+            self.term, MAX_FPS, self.on_key, self.on_frame, wakeup=self.wakeup
+        )
+        self.con.connect(address)
         self.con.start()  # After connecting, start recieving
 
-        while not self.con.ready:
-            pass  # Wait until we start getting data
+        if self.wait_for_game():
+            self.start_online()
+        self.con.stop()
+        self.con.join()  # So nothing rings the wakeup once it's closed.
+        self.wakeup.close()
 
-        self.start_online()
+    def wait_for_game(self) -> bool:
+        """Wait until we start getting data, in line if the server is busy.
+
+        Returns False if the server turned us away or went away.
+        """
+        shown = None
+        while not self.con.ready:
+            busy = self.con.busy
+            if not self.con.is_alive():
+                if busy is None:
+                    self.show_message("Lost connection to the server.")
+                else:
+                    self.show_message("Server busy. Try again later.")
+                with self.term.cbreak():
+                    self.term.inkey()
+                return False
+            if busy is not shown and busy["position"] is not None:
+                self.show_message(
+                    f"Server busy. You are #{busy['position']} in line."
+                )
+            shown = busy
+            time.sleep(0.05)
+        return True
 
     def draw(self, entities: dict):
         """Draw all etities given."""
+        positions = {}
+        frame = []
         for i in entities:
             type = i["type"]
             if type == "snake_segment":
-                # TODO: add artemis' beautiful snake
-                print(
-                    self.term.home
-                    + self.term.move_xy(i["x"], i["y"])
-                    + self.window.player_color(i["player"])
-                    + BLOCK_CHAR
-                    + self.term.normal
-                    + self.term.home
-                )
+                positions.setdefault(i["player"], []).append((i["x"], i["y"]))
             if type == "apple":
-                print(
-                    self.term.home
-                    + self.term.move_xy(i["x"], i["y"])
+                frame.append(
+                    self.term.move_xy(i["x"], i["y"])
                     + self.term.red
                     + BLOCK_CHAR
-                    + self.term.normal
-                    + self.term.home
                 )
 
+        # Forget snakes of players that have left.
+        for player in self.snakes.keys() - positions.keys():
+            del self.snakes[player]
+
+        for player, snake in positions.items():
+            glyphs = self.snakes.setdefault(player, SnakeGlyphs())
+            glyphs.update(snake)
+            color = self.window.player_color(player)
+            for x, y, char in glyphs:
+                frame.append(self.term.move_xy(x, y) + color + char)
+
+        frame.append(self.term.normal + self.term.home)
+        print(end="".join(frame), flush=True)
+
     def end_game(self):
         """End game session."""
         self.show_death_screen()
-        # stop the con thread
-        self.con.stop()
-        self.con.join()
         self.alive = False
+        self.scheduler.stop()
 
     def event_handler(self, type: str, data: any):
         """Server event handler."""
@@ -246,44 +261,44 @@ class OnlineGame(Game):
             (self.con.serverinfo.width, self.con.serverinfo.height)
         )
         self.term = self.window.term
-
-        last_frame_time = current_time = time.time()
+        self.scheduler.term = self.term
 
         self.con.send_event("nick", self.name)  # send our name to server
-
-        while self.alive:
-            # Calculations needed for maintaining stable FPS
-            sleep_time = 1 / FPS - (current_time - last_frame_time)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-
-            self.window.draw_border(name=self.con.serverinfo.name)
-            # Get key presses and send them as change direction events
-            with self.term.cbreak():
-                if key := self.term.inkey(timeout=0).name:
-                    self.direction = logic.change_direction(
-                        key.removeprefix("KEY_").lower(), self.direction
-                    )  # do key loic
-                    self.con.send_event(
-                        "dir", self.direction
-                    )  # send the direction
-
-            data = self.con.get_newest()
-            if data:
-                # get players and draw scoreboard
-                if "players" in data:
-                    self.window.draw_scoreboard(data["players"])
-
-                # check fore server events
-                if "event" in data:
-                    self.event_handler(
-                        data["event"]["type"], data["event"]["data"]
-                    )
-
-                if "entities" in data:
-                    # Draw each entity sent to us
-                    self.draw(data["entities"])
+        self.scheduler.run()
 
         # wait for key press to return to main menu
         with self.term.cbreak():
             self.term.inkey()
+
+    def on_key(self, key: Keystroke):
+        """Send a turn to the server as soon as its key is pressed."""
+        if key.name:
+            self.direction = logic.change_direction(
+                key.name.removeprefix("KEY_").lower(), self.direction
+            )  # do key loic
+            self.con.send_turn(self.direction)  # send the direction
+
+    def on_frame(self):
+        """Draw the newest data from the server."""
+        # Only clear the screen once, so the scoreboard stays drawn.
+        self.window.draw_border(name=self.con.serverinfo.name, clear=self.clear)
+        self.clear = False
+
+        data = self.con.get_newest()
+        if data:
+            # get players and draw scoreboard
+            if "players" in data:
+                self.players = data["players"]
+            self.window.draw_scoreboard(self.players)
+
+            # check fore server events
+            if "event" in data:
+                self.event_handler(data["event"]["type"], data["event"]["data"])
+
+            if "entities" in data:
+                # Draw each entity sent to us
+                self.draw(data["entities"])
+
+        if self.alive and self.con.terminate_flag.is_set():
+            self.show_message("Lost connection to the server.")
+            self.scheduler.stop()
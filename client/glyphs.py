@@ -0,0 +1,116 @@
+"""Box-drawing glyphs for snakes.
+
+A snake only changes in three places between frames: the new head, the old
+head (which becomes the neck) and the tail. `SnakeGlyphs` caches the glyph of
+every segment and only works out those cells again when the snake moves.
+"""
+from collections import deque
+from typing import Iterator, Sequence
+
+BLOCK_CHAR = "█"
+
+# N[orth]/E[ast]/S[outh]/[W]est indicates direction of segment to join on to.
+SNAKE_HEAD_CHARS = {
+    "n": "╹",
+    "e": "╺",
+    "s": "╻",
+    "w": "╸",
+}
+
+SNAKE_BODY_CHARS = {
+    "ew": "═",
+    "ns": "║",
+    "es": "╔",
+    "sw": "╗",
+    "ne": "╚",
+    "nw": "╝",
+    "ww": "═",
+}
+
+SNAKE_TAIL_CHARS = {
+    "n": "╿",
+    "e": "╼",
+    "s": "╽",
+    "w": "╾",
+}
+
+Position = tuple[int, int]
+Cell = tuple[int, int, str]
+
+
+def direction(from_pos: Position, to_pos: Position) -> str:
+    """Find the direction from one segment to another.
+
+    Assumes these segments are connected.
+    """
+    if from_pos[0] == to_pos[0]:
+        return "n" if to_pos[1] < from_pos[1] else "s"
+    else:
+        return "e" if to_pos[0] > from_pos[0] else "w"
+
+
+def segment_glyph(positions: Sequence[Position], index: int) -> str:
+    """Get the glyph for the segment at an index of a snake."""
+    if index < 0:
+        index += len(positions)
+    if len(positions) < 2:
+        return BLOCK_CHAR
+    pos = positions[index]
+    if index == 0:
+        return SNAKE_HEAD_CHARS[direction(pos, positions[1])]
+    if index == len(positions) - 1:
+        return SNAKE_TAIL_CHARS[direction(pos, positions[index - 1])]
+    before_dir = direction(pos, positions[index - 1])
+    after_dir = direction(pos, positions[index + 1])
+    return SNAKE_BODY_CHARS.get(
+        before_dir + after_dir,
+        SNAKE_BODY_CHARS.get(after_dir + before_dir, BLOCK_CHAR),
+    )
+
+
+class SnakeGlyphs:
+    """The glyphs of one snake, kept up to date between frames."""
+
+    def __init__(self):
+        """Set up an empty snake."""
+        self.positions = deque()
+        self.glyphs = deque()
+
+    def __iter__(self) -> Iterator[Cell]:
+        """Iterate over every cell of the snake."""
+        for (x, y), glyph in zip(self.positions, self.glyphs):
+            yield x, y, glyph
+
+    def update(
+        self, positions: Sequence[Position]
+    ) -> tuple[list[Cell], list[Position]]:
+        """Update the snake to its new segment positions.
+
+        Returns the cells whose glyph changed and the positions the snake
+        no longer occupies.
+        """
+        old = self.positions
+        if (
+            len(positions) == len(old) > 2
+            and positions[1] == old[0]
+            and positions[-1] == old[-2]
+        ):
+            # The snake moved by one cell, so only the ends changed.
+            vacated = [old.pop()]
+            self.glyphs.pop()
+            old.appendleft(positions[0])
+            self.glyphs.appendleft("")
+            changed = []
+            for index in (0, 1, -1):
+                self.glyphs[index] = segment_glyph(old, index)
+                x, y = old[index]
+                changed.append((x, y, self.glyphs[index]))
+            return changed, vacated
+
+        # The snake grew, shrank or jumped, so rebuild it from scratch.
+        vacated = list(set(old).difference(positions))
+        self.positions = deque(positions)
+        self.glyphs = deque(
+            segment_glyph(positions, index) for index in range(len(positions))
+        )
+        return list(self), vacated
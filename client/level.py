@@ -1,9 +1,21 @@
 """Models responsible for client side game run."""
-import math
 import random
 
 from blessed import Terminal
 
+_terminal = None
+
+
+def terminal() -> Terminal:
+    """Get the terminal, set up the first time it's needed.
+
+    Setting up a Terminal is slow, so every window shares one.
+    """
+    global _terminal
+    if _terminal is None:
+        _terminal = Terminal()
+    return _terminal
+
 
 class Window:
     """Class for rendering game on the screen."""
@@ -19,7 +31,7 @@ class Window:
 
     def __init__(self, size: tuple[int, int]):
         """Set up the game renderer."""
-        self.term = Terminal()
+        self.term = terminal()
         self.size = size
         self.width, self.height = size
         self.BORDER_COLOR = self.term.bright_green
@@ -35,6 +47,9 @@ class Window:
         self.SNAKE_COLOR = random.choice(self.SNAKE_COLORS)
 
         self.player_colors = []
+        # What the scoreboard currently shows.
+        self.scoreboard_rows = []
+        self.scoreboard_width = 0
 
     def _draw_border_row(
         self, start: str, middle: str, end: str, width: int, x_offset: int = 0
@@ -56,53 +71,71 @@ class Window:
         return self.player_colors[player]
 
     def draw_scoreboard(self, players: list):
-        """Draw the scoreboard."""
-        players = sorted(players, key=lambda x: x["score"])
-        max_len = 1
-        for i in players:
-            i["dname"] = str(i["score"]) + ": " + i["name"]
-            if len(i["dname"]) > max_len:
-                max_len = len(i["dname"])
-
-        max_len += 2
-        # Print the border header
-        self._draw_border_row(
-            self.term.move_y(1) + self.CHAR_ES,
-            self.CHAR_EW,
-            self.CHAR_SW,
-            max_len,
-            self.width + 1,
-        )
+        """Draw the scoreboard, redrawing only the rows that changed.
 
-        # Print border sides
-        for _ in range(len(players)):
+        Players come ranked best first from the server.
+        """
+        rows = []
+        for player in players:
+            row = f"{player['score']}: {player['name']}"
+            if player.get("rtt") is not None:
+                row += f" {player['rtt']}ms"
+            rows.append(row)
+        width = max(map(len, rows), default=1) + 2
+        x = self.width + 1
+
+        if width != self.scoreboard_width or len(rows) != len(
+            self.scoreboard_rows
+        ):
+            # The box changed size, so clear it and draw it again.
+            for y in range(len(self.scoreboard_rows) + 2):
+                print(
+                    self.term.move_xy(x, y + 1) + " " * self.scoreboard_width
+                )
             self._draw_border_row(
-                self.CHAR_NS + self.term.normal,
-                " ",
-                self.BORDER_COLOR + self.CHAR_NS,
-                max_len,
-                self.width + 1,
+                self.term.move_y(1) + self.CHAR_ES,
+                self.CHAR_EW,
+                self.CHAR_SW,
+                width,
+                x,
             )
-
-        # Print the border footer
-        self._draw_border_row(
-            self.CHAR_NE, self.CHAR_EW, self.CHAR_NW, max_len, self.width + 1
-        )
-
-        for player in players:
-            print(
-                self.term.move_xy(
-                    self.width
-                    + math.ceil((max_len - len(player["dname"])) / 2)
-                    + 1,
-                    players.index(player) + 2,
+            for _ in rows:
+                self._draw_border_row(
+                    self.CHAR_NS + self.term.normal,
+                    " ",
+                    self.BORDER_COLOR + self.CHAR_NS,
+                    width,
+                    x,
                 )
-                + player["dname"]
+            self._draw_border_row(
+                self.CHAR_NE, self.CHAR_EW, self.CHAR_NW, width, x
             )
+            old_rows = [None] * len(rows)
+        else:
+            old_rows = self.scoreboard_rows
 
-    def draw_border(self, name: str = "SNAKE"):
-        """Draw the border around the edge of the screen."""
-        print(self.term.home + self.term.clear, end="")  # Clear the screen
+        for index, (row, old_row) in enumerate(zip(rows, old_rows)):
+            if row == old_row:
+                continue
+            print(
+                self.term.move_xy(x + 1, index + 2)
+                + row.center(width - 2)
+            )
+        self.scoreboard_rows = rows
+        self.scoreboard_width = width
+
+    def draw_border(self, name: str = "SNAKE", clear: bool = True):
+        """Draw the border around the edge of the screen.
+
+        Without clearing, everything right of the border, like the
+        scoreboard, is left as it is.
+        """
+        if clear:
+            print(self.term.home + self.term.clear, end="")  # Clear the screen
+            self.scoreboard_rows = []
+            self.scoreboard_width = 0
+        else:
+            print(self.term.home, end="")
 
         print(
             self.term.move_xy(self.width // 2, 0),
@@ -1,50 +1,139 @@
 """Networking module."""
 import socket
 import threading
+import time
 from threading import Thread
+from typing import Callable, Optional, Union
 
 import msgpack
 
-from common import models
+from common import compression, models, transport
+from common.compression import STANDALONE_ZLIB_CODE
+from common.receiver import MAX_SERVER_MESSAGE, Receiver
+from common.simulation import Simulation, Timeline
+
+# Players shown on the scoreboard in lockstep mode.
+TOP_PLAYERS = 10
+# Seconds to keep trying to reach the server a game moved to.
+RECONNECT_TIMEOUT = 10.0
 
 
 class Connection(Thread):
     """Used to connect to server and recieve or send game data."""
 
-    def __init__(self):
-        """Initialize connection class."""
+    def __init__(self, lockstep: bool = False):
+        """Initialize connection class.
+
+        In lockstep mode the server sends us inputs rather than frames, and
+        we simulate the game ourselves.
+        """
         super().__init__()
         self.terminate_flag = threading.Event()
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.settimeout(10)
+        self.sock = None
+        self.send_lock = threading.Lock()  # Pongs are sent from our thread.
         self.newest = None
+        # The newest message, not decoded yet, taken by get_newest.
+        self.pending = None
+        self.pending_lock = threading.Lock()
         self.serverinfo = None
         self.ready = False
+        self.decoder = None
+        self.receiver = None
+        self.said_hello = False
+        self.lockstep = lockstep
+        self.timeline = None  # The game, when simulating it ourselves.
+        self.rtts = {}  # Other players' RTTs, in lockstep mode.
+        self.rtt = None  # Ours in milliseconds, as the server measured it.
+        self.tick = None  # Tick of the newest data shown.
+        self.resyncing = False
+        self.resume = None  # Token to get our snake back after a migration.
+        # Why the server can't let us in yet and our place in line, if so.
+        self.busy = None
+        # Called from our thread when there's new data, or we've stopped.
+        self.on_data: Optional[Callable[[], None]] = None
+
+    def connect(self, address: str, hello: bool = True):
+        """Call to connect to server.
 
-    def connect(self, host: str, port: int):
-        """Call to connect to server."""
-        self.sock.connect((host, port))
+        The address can be any transport, see `common.transport`. Without a
+        hello, the server answers queries but won't add us to a game.
+        """
+        self.sock = transport.connect(address, timeout=10)
+        self.receiver = Receiver(self.sock, MAX_SERVER_MESSAGE)
+        self.said_hello = hello
+        if hello:
+            # Offer our compression modes, the server will pick one.
+            self.send_event(
+                "hello",
+                {
+                    "compression": compression.available(),
+                    "lockstep": self.lockstep,
+                    "resume": self.resume,
+                },
+            )
+
+    def query_leaderboard(self, name: str) -> dict:
+        """Get the top scores and our rank, without starting the thread."""
+        self.send_event("leaderboard", {"name": name})
+        while True:
+            messages = self.receiver.receive()
+            if messages is None:
+                raise ConnectionError("Server closed the connection.")
+            for message in messages:
+                event = message.get("event", {})
+                if event.get("type") == "redirect":
+                    self.handle(message)
+                    self.send_event("leaderboard", {"name": name})
+                elif event.get("type") == "leaderboard":
+                    self.sock.close()
+                    return event["data"]
 
     def send(self, msg: dict):
         """Pack and send data."""
         packed = msgpack.packb(msg, use_bin_type=True)  # pack the data
-        self.sock.sendall(packed)  # send data
+        with self.send_lock:
+            self.sock.sendall(packed)  # send data
 
     def send_event(self, type: str, data: any):
         """Send event to server."""
         self.send({"event": {"type": type, "data": data}})
 
+    def send_turn(self, direction: tuple[int, int]):
+        """Send a turn, stamped with the tick after the one on screen."""
+        tick = None if self.tick is None else self.tick + 1
+        self.send_event("dir", {"direction": direction, "tick": tick})
+
     def stop(self):
         """Stop the thread."""
         self.terminate_flag.set()
 
     def get_newest(self) -> dict:
-        """Get the newest recieved data."""
+        """Get the newest recieved data.
+
+        Frames are decoded here rather than as they arrive, so frames that
+        are replaced before anyone asks for them are never decoded.
+        """
+        with self.pending_lock:
+            message = self.pending
+            self.pending = None
+        if isinstance(message, msgpack.ExtType):
+            message = self.decoder.decompress(message)
+        if isinstance(message, bytes):
+            message = msgpack.unpackb(message, raw=False)
+        if message is not None:
+            self.newest = message
+            self.tick = message.get("tick", self.tick)
         return self.newest
 
-    def get_server_info(self):
+    def set_pending(self, message: Union[dict, bytes, msgpack.ExtType]):
+        """Make a message the one the next get_newest returns."""
+        with self.pending_lock:
+            self.pending = message
+        if self.on_data is not None:
+            self.on_data()
+
+    def get_server_info(self, info: dict):
         """Set the serer metadata."""
-        info = self.newest["meta"]
         self.serverinfo = models.ServerInfo(
             name=info["name"],
             version=info["version"],
@@ -52,20 +141,148 @@ class Connection(Thread):
             height=info["height"],
         )
 
+    def handle(self, message: Union[dict, msgpack.ExtType]):
+        """Handle a message from the server."""
+        if isinstance(message, msgpack.ExtType):
+            # A game frame. A stream has to be decompressed in order, but
+            # everything else can wait until the frame is wanted.
+            if self.decoder.streaming and message.code != STANDALONE_ZLIB_CODE:
+                self.set_pending(self.decoder.decompress(message))
+            else:
+                self.set_pending(message)
+            self.ready = True
+        elif message["event"]["type"] == "hello":
+            data = message["event"]["data"]
+            self.decoder = compression.Decoder(data["compression"])
+            # Servers without lockstep support send frames.
+            self.lockstep = data.get("lockstep", False)
+            self.get_server_info(data["meta"])
+        elif message["event"]["type"] == "sync":
+            data = message["event"]["data"]
+            self.timeline = Timeline(
+                Simulation.from_state(data["state"]), data.get("rewind", 0)
+            )
+            self.resyncing = False
+        elif message["event"]["type"] == "tick":
+            self.on_tick(message["event"]["data"])
+        elif message["event"]["type"] == "ping":
+            data = message["event"]["data"]
+            self.rtt = data["rtt"]
+            self.send_event("pong", data["time"])
+        elif message["event"]["type"] == "redirect":
+            # A gateway sent us on to a game server.
+            self.sock.close()
+            data = message["event"]["data"]
+            self.connect(
+                transport.tcp_address(data["host"], data["port"]),
+                self.said_hello,
+            )
+        elif message["event"]["type"] == "busy":
+            self.busy = message["event"]["data"]
+        elif message["event"]["type"] == "migrate":
+            # Our game moved to another server, which may still be starting.
+            self.sock.close()
+            data = message["event"]["data"]
+            self.resume = data["token"]
+            self.timeline = None  # It sends the whole state again.
+            self.resyncing = False
+            self.reconnect(data["address"])
+        else:
+            self.set_pending(message)
+
+    def reconnect(self, address: str):
+        """Connect and say hello again, retrying for a while."""
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        while True:
+            try:
+                self.connect(address, self.said_hello)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.25)
+
+    def on_tick(self, data: dict):
+        """Simulate a tick from its inputs, checking we're still in sync."""
+        timeline = self.timeline
+        if timeline is None or self.resyncing:
+            return
+        if data["tick"] <= timeline.simulation.tick:
+            return  # Already part of the state we were sent.
+        if data["tick"] != timeline.simulation.tick + 1:
+            self.resync()
+            return
+        late = data.get("late")
+        if late:
+            # The server played some ticks again with late turns.
+            if not all(timeline.can_rewind(tick) for tick, _ in late):
+                self.resync()
+                return
+            timeline.rewind(late)
+        timeline.step(data["inputs"])
+        if "rtt" in data:
+            self.rtts = dict(data["rtt"])
+        if "hash" in data and timeline.simulation.hash() != data["hash"]:
+            self.resync()
+
+    def resync(self):
+        """Ask the server for the whole state, having fallen out of sync."""
+        self.resyncing = True
+        self.send_event("resync", None)
+
+    def simulation_step(self) -> tuple:
+        """Identify the simulated state, to tell when it changes."""
+        if self.timeline is None:
+            return None, None
+        simulation = self.timeline.simulation
+        return id(simulation), simulation.tick
+
+    def show_simulation(self):
+        """Make the simulated state the newest data, like a frame."""
+        if self.timeline is None:
+            return
+        simulation = self.timeline.simulation
+        ranked = sorted(
+            simulation.players.values(),
+            key=lambda player: (-player.score, player.id),
+        )
+        self.set_pending(
+            {
+                "tick": simulation.tick,
+                "players": [
+                    {
+                        "id": player.id,
+                        "name": player.name,
+                        "score": player.score,
+                        "rtt": self.rtts.get(player.id),
+                    }
+                    for player in ranked[:TOP_PLAYERS]
+                ],
+                "entities": [
+                    entity.dict() for entity in simulation.entities()
+                ],
+            }
+        )
+        self.ready = True
+
     def run(self):
         """Thread to recieve data."""
-        unpacker = msgpack.Unpacker(raw=False)
         while not self.terminate_flag.is_set():
             try:
-                r = self.sock.recv(1024)
-                if r:
-                    unpacker.feed(r)
-                    for i in unpacker:
-                        self.newest = i
-                        self.get_server_info()
-                        self.ready = True
+                messages = self.receiver.receive()
+                if messages is None:
+                    self.terminate_flag.set()  # The server closed it.
+                else:
+                    before = self.simulation_step()
+                    for i in messages:
+                        self.handle(i)
+                    if self.simulation_step() != before:
+                        # Only show the state after the last tick we got.
+                        self.show_simulation()
             except Exception as e:
                 if e is socket.timeout:
                     pass  # ignore socket timeouts, the connection shouldnt stop
                 else:
                     self.terminate_flag.set()
+        if self.on_data is not None:
+            self.on_data()  # So whoever is waiting on us sees we stopped.
@@ -0,0 +1,175 @@
+"""Scheduling the client's input, drawing and network handling.
+
+A `Scheduler` puts the terminal in cbreak mode once, then sleeps in
+`select` until a key is pressed, the network thread rings its `Wakeup`
+with new data, or the next frame is due. Keys are handled as soon as they
+arrive, so a turn is sent well within a millisecond of the key press, and
+frames are drawn at most `fps` times a second. Pressing "f" shows how long
+frames take to draw in the top left corner.
+"""
+import os
+import select
+import sys
+import time
+from typing import Callable, Optional
+
+from blessed import Terminal
+from blessed.keyboard import Keystroke
+
+# Key that shows and hides the frame time overlay.
+OVERLAY_KEY = "f"
+# Weight of each new sample in the smoothed frame times.
+SMOOTHING = 1 / 8
+
+
+class Wakeup:
+    """A pipe another thread writes to, to wake the scheduler."""
+
+    def __init__(self):
+        """Make the pipe."""
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+
+    def fileno(self) -> int:
+        """Get the end of the pipe to select on."""
+        return self.read_fd
+
+    def set(self):
+        """Wake the scheduler, from any thread."""
+        try:
+            os.write(self.write_fd, b"\0")
+        except BlockingIOError:
+            pass  # The pipe is full, so it will wake anyway.
+
+    def clear(self):
+        """Empty the pipe, once woken."""
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        """Close both ends of the pipe."""
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class Scheduler:
+    """Runs a game's input handling and drawing from one loop.
+
+    `on_key` is called with each key pressed. `on_frame` draws a frame: on
+    every frame when `steady`, like a game stepped locally, and otherwise
+    only when woken since the last one, like when the server sent data.
+    `on_redraw`, if given, redraws what the overlay covered once hidden.
+    """
+
+    def __init__(
+        self,
+        term: Terminal,
+        fps: float,
+        on_key: Callable[[Keystroke], None],
+        on_frame: Callable[[], None],
+        steady: bool = False,
+        wakeup: Optional[Wakeup] = None,
+        on_redraw: Optional[Callable[[], None]] = None,
+    ):
+        """Set up the scheduler."""
+        self.term = term
+        self.interval = 1 / fps
+        self.on_key = on_key
+        self.on_frame = on_frame
+        self.steady = steady
+        self.wakeup = wakeup
+        self.on_redraw = on_redraw
+        self.running = False
+        self.overlay = False
+        # Smoothed, in seconds.
+        self.frame_time = 0.0
+        self.frame_interval = self.interval
+        self.last_frame = 0.0
+
+    def stop(self):
+        """Stop the loop, from a key or frame handler."""
+        self.running = False
+
+    def run(self):
+        """Handle keys and draw frames until stopped."""
+        self.running = True
+        readers = [sys.stdin]
+        if self.wakeup is not None:
+            readers.append(self.wakeup)
+        # A frame is wanted as soon as we start.
+        woken = True
+        next_frame = time.perf_counter()
+        with self.term.cbreak(), self.term.hidden_cursor():
+            while self.running:
+                timeout = max(0.0, next_frame - time.perf_counter())
+                if not (woken or self.steady):
+                    timeout = None  # Nothing to draw until we're woken.
+                ready, _, _ = select.select(readers, [], [], timeout)
+
+                if sys.stdin in ready:
+                    self.read_keys()
+                if self.wakeup in ready:
+                    self.wakeup.clear()
+                    woken = True
+
+                now = time.perf_counter()
+                due = woken or self.steady
+                if self.running and due and now >= next_frame:
+                    woken = False
+                    self.frame(now)
+                    next_frame += self.interval
+                    if next_frame < now:
+                        next_frame = now + self.interval  # Fell behind.
+
+    def read_keys(self):
+        """Handle every key waiting, including any the terminal buffered."""
+        while self.running:
+            key = self.term.inkey(timeout=0)
+            if not key:
+                return
+            if key == OVERLAY_KEY:
+                self.overlay = not self.overlay
+                if not self.overlay:
+                    self.clear_overlay()
+            else:
+                self.on_key(key)
+
+    def frame(self, now: float):
+        """Draw a frame, and time it."""
+        if self.last_frame:
+            interval = now - self.last_frame
+            self.frame_interval += SMOOTHING * (interval - self.frame_interval)
+        self.last_frame = now
+        self.on_frame()
+        work = time.perf_counter() - now
+        self.frame_time += SMOOTHING * (work - self.frame_time)
+        if self.overlay:
+            self.draw_overlay()
+
+    def overlay_text(self) -> str:
+        """Describe the frame times."""
+        fps = 1 / self.frame_interval if self.frame_interval else 0
+        return f" {self.frame_time * 1000:5.1f} ms {fps:4.0f} fps "
+
+    def draw_overlay(self):
+        """Show the frame times in the top left corner."""
+        print(
+            end=self.term.move_xy(0, 0)
+            + self.term.reverse
+            + self.overlay_text()
+            + self.term.normal,
+            flush=True,
+        )
+
+    def clear_overlay(self):
+        """Remove the frame times from the screen."""
+        print(
+            end=self.term.move_xy(0, 0) + " " * len(self.overlay_text()),
+            flush=True,
+        )
+        if self.on_redraw is not None:
+            self.on_redraw()
@@ -1,2 +1,10 @@
 """Tools and utilities common to the client and server."""
-from .models import Game  # noqa: F401
+
+
+def __getattr__(name: str) -> object:
+    """Import `Game` only once it's used, as pydantic is slow to import."""
+    if name == "Game":
+        from .models import Game
+
+        return Game
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
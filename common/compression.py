@@ -0,0 +1,219 @@
+"""Compression of game frames.
+
+The client offers the modes it supports when it connects and the server picks
+one. Game frames are sent as msgpack ext objects whose code names the mode, so
+the rest of the stream stays plain msgpack.
+
+Encoders are shared by every client of a game using the same mode, so each
+frame is compressed once per tick. The zlib encoder keeps a streaming deflate
+context across frames and flushes it fully every `KEYFRAME_INTERVAL` frames;
+a client may only start decoding the stream at the frame after such a flush.
+Until then, and after missing frames, clients get frames compressed on their
+own.
+"""
+import functools
+import os
+import zlib
+
+import msgpack
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional.
+    zstandard = None
+
+NONE = "none"
+ZLIB = "zlib"
+ZSTD = "zstd"
+
+# Msgpack ext codes for frames in each mode.
+EXT_CODES = {NONE: 0, ZLIB: 1, ZSTD: 2}
+# Ext code for zlib frames compressed on their own, outside of the stream.
+STANDALONE_ZLIB_CODE = 3
+
+KEYFRAME_INTERVAL = 15
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Set to the path of a dictionary made with `train_dictionary` to use it
+# instead of the built in one. Both ends must use the same dictionary.
+ZSTD_DICTIONARY_ENV = "SNAKE_ZSTD_DICTIONARY"
+
+
+def _sample_frame() -> bytes:
+    """Build a packed frame typical of a game, for the built in dictionary."""
+    players = [{"id": i, "name": "Player", "score": 0} for i in range(1, 4)]
+    entities = []
+    for player in players:
+        for index in range(12):
+            entities.append(
+                {
+                    "type": "snake_segment",
+                    "x": 10 - index,
+                    "y": 5,
+                    "player": player["id"],
+                    "is_head": index == 0,
+                    "index": index,
+                }
+            )
+    entities.append({"type": "apple", "x": 20, "y": 10})
+    return msgpack.packb(
+        {
+            "players": players,
+            "entities": entities,
+        },
+        use_bin_type=True,
+    )
+
+
+def train_dictionary(frames: list[bytes], size: int = 16384) -> bytes:
+    """Train a zstd dictionary from recorded packed frames."""
+    return zstandard.train_dictionary(size, frames).as_bytes()
+
+
+@functools.lru_cache(maxsize=None)
+def zstd_dictionary() -> "zstandard.ZstdCompressionDict":
+    """Load the zstd dictionary for game frames."""
+    path = os.environ.get(ZSTD_DICTIONARY_ENV)
+    if path:
+        with open(path, "rb") as f:
+            return zstandard.ZstdCompressionDict(f.read())
+    return zstandard.ZstdCompressionDict(
+        _sample_frame(), dict_type=zstandard.DICT_TYPE_RAWCONTENT
+    )
+
+
+def _zstd_mode() -> str:
+    """Name the zstd mode after its dictionary, so both ends use the same."""
+    data = zstd_dictionary().as_bytes()
+    return f"{ZSTD}:{zlib.crc32(data):08x}"
+
+
+def available() -> list[str]:
+    """List the modes supported here, most preferred first."""
+    modes = [ZLIB, NONE]
+    if zstandard is not None:
+        modes.insert(0, _zstd_mode())
+    return modes
+
+
+def negotiate(offered: list[str]) -> str:
+    """Pick the first offered mode that is supported here."""
+    supported = available()
+    for mode in offered:
+        if mode in supported:
+            return mode
+    return NONE
+
+
+class Encoder:
+    """Sends frames uncompressed."""
+
+    mode = NONE
+    code = EXT_CODES[NONE]
+    # Whether frames depend on earlier ones.
+    streaming = False
+
+    def compress(self, packed: bytes) -> tuple[bytes, bool]:
+        """Compress a frame, and say whether decoding can start with it."""
+        return packed, True
+
+    def encode(self, packed: bytes) -> tuple[bytes, bool]:
+        """Wrap a packed frame, ready to send."""
+        data, keyframe = self.compress(packed)
+        ext = msgpack.ExtType(self.code, data)
+        return msgpack.packb(ext, use_bin_type=True), keyframe
+
+    def encode_standalone(self, packed: bytes) -> bytes:
+        """Wrap a frame so it can be decoded without the frames before it.
+
+        This is for clients that missed frames of a stream.
+        """
+        return self.encode(packed)[0]
+
+
+class ZlibEncoder(Encoder):
+    """Compresses frames with one deflate stream."""
+
+    mode = ZLIB
+    code = EXT_CODES[ZLIB]
+    streaming = True
+
+    def __init__(self):
+        """Set up the deflate stream."""
+        self.compressor = zlib.compressobj(
+            ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        self.frames = 0
+
+    def compress(self, packed: bytes) -> tuple[bytes, bool]:
+        """Compress a frame, and say whether decoding can start with it."""
+        keyframe = self.frames % KEYFRAME_INTERVAL == 0
+        self.frames += 1
+        if self.frames % KEYFRAME_INTERVAL == 0:
+            flush = zlib.Z_FULL_FLUSH  # The next frame is a keyframe.
+        else:
+            flush = zlib.Z_SYNC_FLUSH
+        data = self.compressor.compress(packed) + self.compressor.flush(flush)
+        return data, keyframe
+
+    def encode_standalone(self, packed: bytes) -> bytes:
+        """Wrap a frame so it can be decoded without the frames before it.
+
+        This is for clients that missed frames of a stream.
+        """
+        compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(packed) + compressor.flush()
+        ext = msgpack.ExtType(STANDALONE_ZLIB_CODE, data)
+        return msgpack.packb(ext, use_bin_type=True)
+
+
+class ZstdEncoder(Encoder):
+    """Compresses each frame on its own with a dictionary."""
+
+    code = EXT_CODES[ZSTD]
+
+    def __init__(self):
+        """Set up the compressor."""
+        self.mode = _zstd_mode()
+        self.compressor = zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL, dict_data=zstd_dictionary()
+        )
+
+    def compress(self, packed: bytes) -> tuple[bytes, bool]:
+        """Compress a frame, and say whether decoding can start with it."""
+        return self.compressor.compress(packed), True
+
+
+def encoder(mode: str) -> Encoder:
+    """Create an encoder for a negotiated mode."""
+    if mode == ZLIB:
+        return ZlibEncoder()
+    if mode.startswith(ZSTD):
+        return ZstdEncoder()
+    return Encoder()
+
+
+class Decoder:
+    """Decodes frames from any supported mode."""
+
+    def __init__(self, mode: str):
+        """Set up decoding for a negotiated mode."""
+        self.mode = mode
+        # Stream frames must all be decompressed, in order.
+        self.streaming = mode == ZLIB
+        self.decompressor = None
+        if mode == ZLIB:
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif mode.startswith(ZSTD):
+            self.decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstd_dictionary()
+            )
+
+    def decompress(self, ext: msgpack.ExtType) -> bytes:
+        """Get the packed frame held in a frame ext."""
+        if ext.code == EXT_CODES[NONE]:
+            return ext.data
+        if ext.code == STANDALONE_ZLIB_CODE:
+            return zlib.decompress(ext.data, -zlib.MAX_WBITS)
+        return self.decompressor.decompress(ext.data)
@@ -0,0 +1,194 @@
+"""Sharing a game's frames with other processes through a file.
+
+A server can write each tick's frame, packed with msgpack as it is for
+players, to a ring of fixed size slots in a memory mapped file. Processes on
+the same machine, like recorders, overlays or bots being trained, map the
+file and read the frames from it. They never talk to the server, and the
+server does the same work however many of them there are.
+
+The file starts with a header:
+
+    magic, version, slots, slot size, frames written
+
+and each slot starts with:
+
+    sequence, tick, length
+
+followed by the frame. Frame `n` goes in slot `n % slots`. Its sequence is
+`2n + 1` while it is being written and `2n + 2` once it is, so a reader who
+sees the same even sequence before and after copying a frame knows it
+wasn't overwritten meanwhile. Readers who fall more than a ring behind skip
+to the oldest frame still in it, and count the frames they missed.
+
+Numbers are 8 byte words in the machine's byte order, read and written
+through a memoryview so each is copied in one go. (`struct` zeroes a field
+before packing it, which readers could see.)
+"""
+import mmap
+import os
+import sys
+import time
+from typing import Iterator, Optional
+
+import msgpack
+
+MAGIC = b"SNAKRING"
+VERSION = 1
+WORD = 8
+# Words of the header, after the magic.
+VERSION_WORD, SLOTS_WORD, SLOT_SIZE_WORD, COUNT_WORD = 1, 2, 3, 4
+HEADER_SIZE = 8 * WORD
+# Words at the start of each slot.
+SEQUENCE_WORD, TICK_WORD, LENGTH_WORD = 0, 1, 2
+SLOT_HEADER_SIZE = 3 * WORD
+
+SLOTS = 64
+SLOT_SIZE = 64 * 1024
+
+# A frame: its number, tick and packed state.
+Frame = tuple[int, int, bytes]
+
+
+def slot_word(n: int, slots: int, slot_size: int) -> int:
+    """Get the index of the first word of frame `n`'s slot."""
+    return (HEADER_SIZE + (n % slots) * slot_size) // WORD
+
+
+class FrameRingWriter:
+    """Writes frames to a ring, for a single writer."""
+
+    def __init__(
+        self, path: str, slots: int = SLOTS, slot_size: int = SLOT_SIZE
+    ):
+        """Create the ring file, replacing any ring already there."""
+        if slot_size % WORD:
+            raise ValueError(f"Slot size must be a multiple of {WORD}")
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.count = 0
+        size = HEADER_SIZE + slots * slot_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.words = memoryview(self.map).cast("Q")
+        self.words[COUNT_WORD] = 0
+        # Forget the frames of any older ring, so none are read as ours.
+        for slot in range(slots):
+            self.words[slot_word(slot, slots, slot_size)] = 0
+        self.map[:WORD] = MAGIC
+        self.words[VERSION_WORD] = VERSION
+        self.words[SLOTS_WORD] = slots
+        self.words[SLOT_SIZE_WORD] = slot_size
+
+    def publish(self, tick: int, data: bytes) -> bool:
+        """Write a frame, returning False if it is too big for a slot."""
+        if SLOT_HEADER_SIZE + len(data) > self.slot_size:
+            return False
+        n = self.count
+        word = slot_word(n, self.slots, self.slot_size)
+        start = word * WORD + SLOT_HEADER_SIZE
+        end = start + len(data)
+        self.words[word + SEQUENCE_WORD] = 2 * n + 1
+        self.words[word + TICK_WORD] = tick
+        self.words[word + LENGTH_WORD] = len(data)
+        self.map[start:end] = data
+        self.words[word + SEQUENCE_WORD] = 2 * n + 2
+        self.count = n + 1
+        self.words[COUNT_WORD] = self.count
+        return True
+
+    def close(self):
+        """Stop writing. The file is left for readers to finish with."""
+        self.words.release()
+        self.map.close()
+
+
+class FrameRingReader:
+    """Reads frames from a ring another process writes."""
+
+    def __init__(self, path: str):
+        """Map the ring file, starting at the newest frame."""
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.words = memoryview(self.map).cast("Q")
+        if self.map[:WORD] != MAGIC or self.words[VERSION_WORD] != VERSION:
+            self.close()
+            raise ValueError(f"Not a frame ring: {path}")
+        self.slots = self.words[SLOTS_WORD]
+        self.slot_size = self.words[SLOT_SIZE_WORD]
+        self.next = max(0, self.written() - 1)
+        self.missed = 0  # Frames overwritten before they were read.
+
+    def written(self) -> int:
+        """Get the number of frames written so far."""
+        return self.words[COUNT_WORD]
+
+    def read(self, n: int) -> Optional[Frame]:
+        """Read frame `n`, or None if it isn't in the ring."""
+        word = slot_word(n, self.slots, self.slot_size)
+        sequence = self.words[word + SEQUENCE_WORD]
+        if sequence != 2 * n + 2:
+            return None
+        tick = self.words[word + TICK_WORD]
+        length = min(
+            self.words[word + LENGTH_WORD], self.slot_size - SLOT_HEADER_SIZE
+        )
+        start = word * WORD + SLOT_HEADER_SIZE
+        end = start + length
+        data = self.map[start:end]
+        # Check it wasn't overwritten while copied.
+        if self.words[word + SEQUENCE_WORD] != sequence:
+            return None
+        return n, tick, data
+
+    def poll(self) -> list[Frame]:
+        """Read the frames written since the last poll."""
+        written = self.written()
+        if written < self.next:
+            self.next = 0  # The writer started again.
+        oldest = max(self.next, written - self.slots + 1)
+        self.missed += oldest - self.next
+        frames = []
+        for n in range(oldest, written):
+            frame = self.read(n)
+            if frame is None:
+                self.missed += 1
+            else:
+                frames.append(frame)
+        self.next = written
+        return frames
+
+    def follow(self, interval: float = 0.01) -> Iterator[Frame]:
+        """Read frames as they are written, forever."""
+        while True:
+            yield from self.poll()
+            time.sleep(interval)
+
+    def close(self):
+        """Unmap the ring."""
+        self.words.release()
+        self.map.close()
+
+
+def main():
+    """Print a summary of each frame written to a ring."""
+    reader = FrameRingReader(sys.argv[1])
+    try:
+        for n, tick, data in reader.follow():
+            state = msgpack.unpackb(data, raw=False)
+            print(
+                f"tick {tick}: {len(state['entities'])} entities, "
+                f"{len(data)} bytes, {reader.missed} missed"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
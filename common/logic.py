@@ -4,8 +4,10 @@ This is used for calculationg position
 and other game mechanics.
 """
 import random
+from typing import Optional
 
 from .models import Apple, SnakeSegment
+from .world import World
 
 STARTING_SNAKE_SEGMENTS = 10
 
@@ -14,6 +16,7 @@ UP = (0, -1)
 DOWN = (0, 1)
 LEFT = (-1, 0)
 RIGHT = (1, 0)
+DIRECTIONS = (UP, DOWN, LEFT, RIGHT)
 
 
 def add_segment(segments: list, head: bool = False, id: int = 0):
@@ -55,12 +58,38 @@ def change_direction(
     return direction
 
 
-def move(direction: tuple[int, int], segments: list[SnakeSegment]):
+def place_snake(world: World, segments: list[SnakeSegment]):
+    """Add the cells of a snake to the world.
+
+    Snake cells are occupied by (player id, is head) tuples.
+    """
+    for segment in segments:
+        world.add(segment.x, segment.y, (segment.player, segment.index == 0))
+
+
+def remove_snake(world: World, segments: list[SnakeSegment]):
+    """Remove the cells of a snake from the world."""
+    for segment in segments:
+        world.remove(segment.x, segment.y, (segment.player, segment.index == 0))
+
+
+def move(
+    direction: tuple[int, int],
+    segments: list[SnakeSegment],
+    world: Optional[World] = None,
+):
     """Move the snake.
 
-    This should be called each frame.
+    This should be called each frame. Only the cells of the old tail, the
+    old head and the new head change in the world.
     """
     head = segments[0]
+    if world is not None:
+        tail = segments[-1]
+        world.remove(tail.x, tail.y, (tail.player, tail.index == 0))
+        if len(segments) > 1:
+            world.remove(head.x, head.y, (head.player, True))
+            world.add(head.x, head.y, (head.player, False))
     for segment in segments[:0:-1]:
         before = segments[segment.index - 1]
         segment.x = before.x
@@ -68,6 +97,8 @@ def move(direction: tuple[int, int], segments: list[SnakeSegment]):
 
     head.x += direction[0]
     head.y += direction[1]
+    if world is not None:
+        world.add(head.x, head.y, (head.player, True))
 
 
 def check_apple(segments: list, apple: Apple) -> bool:
@@ -77,18 +108,61 @@ def check_apple(segments: list, apple: Apple) -> bool:
         return (head.x, head.y) == (apple.x, apple.y)
 
 
-def create_apple(size: tuple[int, int], segments: list) -> Apple:
-    """Create apple object."""
+def create_apple(
+    size: tuple[int, int],
+    segments: list,
+    world: Optional[World] = None,
+    rng: Optional[random.Random] = None,
+) -> Apple:
+    """Create apple object on a free cell.
+
+    The world is added to, if given. Pass a seeded `rng` to pick the same
+    cell every time.
+    """
+    if rng is None:
+        rng = random  # The module's shared generator.
+    occupied = {(i.x, i.y) for i in segments}
     while True:
         coords = (
-            random.randrange(2, size[0] - 2),
-            random.randrange(2, size[1] - 2),
+            rng.randrange(2, size[0] - 2),
+            rng.randrange(2, size[1] - 2),
         )
-        for i in segments:
-            if (i.x, i.y) == coords:
-                break
+        if coords in occupied or (world is not None and coords in world):
+            continue
         break
-    return Apple(x=coords[0], y=coords[1])
+    apple = Apple(x=coords[0], y=coords[1])
+    if world is not None:
+        world.add(apple.x, apple.y, apple)
+    return apple
+
+
+def apple_at(world: World, x: int, y: int) -> Optional[Apple]:
+    """Get the apple on a cell, if there is one."""
+    for occupant in world.at(x, y):
+        if isinstance(occupant, Apple):
+            return occupant
+    return None
+
+
+def collided_players(world: World, segments: list[SnakeSegment]) -> list[int]:
+    """Get the players whose bodies the snake's head is in.
+
+    The snake's own player is included if it has collided with itself.
+    Heads are not counted, like in `has_collided_with_others`. Players are
+    sorted by id, so the result doesn't depend on the order cells were
+    filled in.
+    """
+    if not segments:
+        return []
+    head = segments[0]
+    players = []
+    seen_own_head = False
+    for occupant in world.at(head.x, head.y):
+        if occupant == (head.player, True) and not seen_own_head:
+            seen_own_head = True
+        elif isinstance(occupant, tuple) and not occupant[1]:
+            players.append(occupant[0])
+    return sorted(players)
 
 
 def has_collided_with_others(
@@ -1,5 +1,5 @@
 """Pydantic models for game data."""
-from typing import List, Literal, Union
+from typing import List, Literal, Optional, Union
 
 import pydantic
 
@@ -19,6 +19,7 @@ class Player(pydantic.BaseModel):
     id: int
     name: str
     score: int
+    rtt: Optional[int] = None  # Round trip time in milliseconds.
 
 
 class BaseEntity(pydantic.BaseModel):
@@ -51,8 +52,13 @@ Entity = Union[Apple, SnakeSegment]
 
 
 class Game(pydantic.BaseModel):
-    """All the data for a game as shared with clients."""
+    """All the data for a game as shared with clients.
 
-    meta: ServerInfo
-    players: List[Player]
+    Players are ranked best first, and only sent when the ranking changes.
+    The server metadata is sent once, in the reply to a client's hello,
+    rather than in frames.
+    """
+
+    tick: Optional[int] = None
+    players: Optional[List[Player]] = None
     entities: List[Entity]
@@ -0,0 +1,84 @@
+"""Reading msgpack messages from a socket.
+
+Each connection has a `Receiver` with a buffer that is read into with
+`recv_into` and fed straight to its unpacker, so a read allocates nothing
+until the buffer needs to change size. The buffer doubles while reads fill
+it and halves again while they stay small. The unpacker's buffer is bounded,
+so a peer can't make us hold more than one oversized message's worth of
+bytes; going over the bound raises `MessageError`.
+"""
+from typing import Optional
+
+import msgpack
+
+from . import transport
+
+MIN_READ = 1024
+MAX_READ = 256 * 1024
+# Reads in a row using under a quarter of the buffer before it is halved.
+SHRINK_AFTER = 64
+
+# Largest message a client may send the server, in bytes.
+MAX_CLIENT_MESSAGE = 16 * 1024
+# Largest message the server may send a client, like a frame of a big board.
+MAX_SERVER_MESSAGE = 32 * 1024 * 1024
+
+
+class MessageError(ValueError):
+    """A message was too large or malformed."""
+
+
+class Receiver:
+    """Reads messages from a socket into a reused buffer."""
+
+    def __init__(self, sock: transport.Connection, max_message: int):
+        """Set up the buffers for a connection."""
+        self.sock = sock
+        self.buffer = bytearray(MIN_READ)
+        self.view = memoryview(self.buffer)
+        self.unpacker = msgpack.Unpacker(
+            raw=False, max_buffer_size=max_message
+        )
+        self.small_reads = 0
+        self.data = self.view[:0]  # The bytes of the last read.
+        # Counted for metrics.
+        self.reads = 0
+        self.received = 0  # Bytes.
+        self.allocations = 1  # Buffers allocated.
+
+    def resize(self, size: int):
+        """Replace the buffer with one of a new size."""
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.small_reads = 0
+        self.allocations += 1
+
+    def receive(self) -> Optional[list]:
+        """Wait for data and get every message it completes.
+
+        Returns None once the connection is closed. Socket errors, like
+        timeouts, are raised as usual. The bytes read are left in `data`
+        until the next call.
+        """
+        capacity = len(self.buffer)
+        if len(self.data) == capacity and capacity < MAX_READ:
+            self.resize(capacity * 2)  # The last read filled the buffer.
+        elif self.small_reads >= SHRINK_AFTER:
+            self.resize(capacity // 2)
+
+        size = self.sock.recv_into(self.view)
+        self.data = self.view[:size]
+        if not size:
+            return None
+        self.reads += 1
+        self.received += size
+        if size < len(self.buffer) // 4 and len(self.buffer) > MIN_READ:
+            self.small_reads += 1
+        else:
+            self.small_reads = 0
+
+        try:
+            self.unpacker.feed(self.data)
+            return list(self.unpacker)
+        except (msgpack.BufferFull, ValueError) as e:
+            raise MessageError(str(e) or type(e).__name__) from e
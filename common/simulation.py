@@ -0,0 +1,293 @@
+"""Deterministic simulation of an online game.
+
+The server and lockstep clients run the same `Simulation`. Given the same
+state and the same inputs, `step` gives the same result everywhere: players
+are processed in id order, collisions are resolved by lowest id, and apples
+are placed by a generator seeded from the game's seed and the number of
+apples made so far. A state can be captured with `to_state`, sent to a
+client and restored with `from_state`, and compared cheaply with `hash`.
+A `Timeline` keeps the last few ticks, so late inputs can be slipped into
+the tick they were meant for.
+
+Inputs are [type, player id, data] lists, with the types "join" (data is
+the name), "leave", "dir" (data is the direction) and "nick" (data is the
+name). The server validates inputs before they reach the simulation.
+"""
+import random
+import zlib
+from collections import deque
+from typing import Callable, Optional
+
+import msgpack
+
+from . import logic
+from .models import Apple, SnakeSegment
+from .world import World
+
+# Ticks between state hashes sent to lockstep clients.
+HASH_INTERVAL = 15
+
+
+def _no_lap(phase: str):
+    """Ignore the end of a phase."""
+
+
+class SimPlayer:
+    """A player's snake and score."""
+
+    __slots__ = ("id", "name", "score", "direction", "segments")
+
+    def __init__(self, id: int, name: str):
+        """Set up a player with a new snake."""
+        self.id = id
+        self.name = name
+        self.score = 0
+        self.direction = logic.RIGHT
+        self.segments: list[SnakeSegment] = []
+        for _ in range(logic.STARTING_SNAKE_SEGMENTS):
+            logic.add_segment(self.segments, id=id)
+
+
+class Simulation:
+    """The state of a game and the rules that advance it."""
+
+    def __init__(self, width: int, height: int, seed: int):
+        """Set up an empty board."""
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.tick = 0
+        self.apples_made = 0
+        self.players: dict[int, SimPlayer] = {}
+        self.apples: list[Apple] = []
+        self.world = World()  # Index of what is on each cell.
+
+    def add_apple(self):
+        """Add an apple on a free cell."""
+        rng = random.Random(self.seed * 1_000_003 + self.apples_made)
+        self.apples_made += 1
+        self.apples.append(
+            logic.create_apple((self.width, self.height), [], self.world, rng)
+        )
+
+    def join(self, id: int, name: str):
+        """Add a player, and an apple for them."""
+        player = self.players[id] = SimPlayer(id, name)
+        logic.place_snake(self.world, player.segments)
+        self.add_apple()
+
+    def remove(self, id: int) -> SimPlayer:
+        """Remove a player and the oldest apple."""
+        player = self.players.pop(id)
+        logic.remove_snake(self.world, player.segments)
+        if self.apples:
+            apple = self.apples.pop(0)
+            self.world.remove(apple.x, apple.y, apple)
+        return player
+
+    def grow(self, player: SimPlayer):
+        """Add a segment to a player's snake, on top of its tail."""
+        tail = player.segments[-1]
+        logic.add_segment(player.segments, id=player.id)
+        segment = player.segments[-1]
+        segment.x, segment.y = tail.x, tail.y
+        self.world.add(segment.x, segment.y, (segment.player, False))
+
+    def step(
+        self,
+        inputs: list[list],
+        lap: Optional[Callable[[str], None]] = None,
+    ) -> list[SimPlayer]:
+        """Apply a tick's inputs and advance the game by a tick.
+
+        Returns the players who died or left, in the order they did. Dead
+        snakes stay on the board until every player has moved. `lap` is
+        called with the name of each phase of a player's move as it ends,
+        for profiling.
+        """
+        if lap is None:
+            lap = _no_lap
+        dead: dict[int, SimPlayer] = {}
+        for type, id, data in inputs:
+            if type == "join":
+                self.join(id, data)
+                continue
+            player = self.players.get(id)
+            if player is None or id in dead:
+                continue  # Already gone.
+            if type == "leave":
+                dead[id] = player
+            elif type == "dir":
+                player.direction = tuple(data)
+            elif type == "nick":
+                player.name = data
+
+        for id in sorted(self.players):
+            player = self.players[id]
+            if id in dead:
+                continue
+            logic.move(player.direction, player.segments, self.world)
+            lap("move")
+
+            hit = logic.collided_players(self.world, player.segments)
+            if (
+                logic.has_collided_with_wall(
+                    self.width, self.height, player.segments
+                )
+                or id in hit
+            ):
+                dead[id] = player
+                lap("collide")
+                continue
+            lap("collide")
+
+            if hit:
+                # Ran into another snake, which takes the score.
+                dead[id] = player
+                other = self.players[hit[0]]
+                if other.id not in dead:
+                    other.score += player.score
+                    for i in range(1, other.score // 2):
+                        self.grow(other)
+                lap("collide_players")
+                continue
+            lap("collide_players")
+
+            head = player.segments[0]
+            apple = logic.apple_at(self.world, head.x, head.y)
+            if apple is not None:
+                player.score += 1
+                self.grow(player)
+                del self.apples[self.apples.index(apple)]
+                self.world.remove(apple.x, apple.y, apple)
+                self.add_apple()
+            lap("apples")
+
+        for id in dead:
+            self.remove(id)
+        self.tick += 1
+        return list(dead.values())
+
+    def entities(self) -> list:
+        """Get every snake segment and apple on the board."""
+        entities = []
+        for id in sorted(self.players):
+            entities.extend(self.players[id].segments)
+        entities.extend(self.apples)
+        return entities
+
+    def to_state(self) -> dict:
+        """Capture the state, in a form msgpack can pack."""
+        return {
+            "width": self.width,
+            "height": self.height,
+            "seed": self.seed,
+            "tick": self.tick,
+            "apples_made": self.apples_made,
+            "players": [
+                [
+                    player.id,
+                    player.name,
+                    player.score,
+                    list(player.direction),
+                    [[segment.x, segment.y] for segment in player.segments],
+                ]
+                for player in (self.players[id] for id in sorted(self.players))
+            ],
+            "apples": [[apple.x, apple.y] for apple in self.apples],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "Simulation":
+        """Restore a state captured with `to_state`.
+
+        The state is trusted, so entities are built without validation,
+        which keeps restoring a big game to a few milliseconds.
+        """
+        simulation = cls(state["width"], state["height"], state["seed"])
+        simulation.tick = state["tick"]
+        simulation.apples_made = state["apples_made"]
+        for id, name, score, direction, cells in state["players"]:
+            player = SimPlayer(id, name)
+            player.score = score
+            player.direction = tuple(direction)
+            player.segments = [
+                SnakeSegment.construct(
+                    index=index, x=x, y=y, player=id, is_head=index == 0
+                )
+                for index, (x, y) in enumerate(cells)
+            ]
+            simulation.players[id] = player
+            logic.place_snake(simulation.world, player.segments)
+        for x, y in state["apples"]:
+            apple = Apple.construct(x=x, y=y)
+            simulation.apples.append(apple)
+            simulation.world.add(x, y, apple)
+        return simulation
+
+    def hash(self, state: Optional[dict] = None) -> int:
+        """Get a checksum of the state, to compare with another copy's."""
+        if state is None:
+            state = self.to_state()
+        return zlib.crc32(msgpack.packb(state, use_bin_type=True))
+
+
+class Timeline:
+    """A simulation that remembers its last few ticks.
+
+    Inputs that arrive late can still be applied on the tick they were meant
+    for: the simulation goes back to the state before that tick and plays
+    the ticks since again. Ticks where a player was removed can't be played
+    again, as the server has already told them, so the history is cleared
+    whenever that happens.
+    """
+
+    def __init__(self, simulation: Simulation, window: int):
+        """Keep up to `window` ticks of a simulation."""
+        self.simulation = simulation
+        self.window = window
+        # The state before each tick, and that tick's inputs.
+        self.history: deque[tuple[dict, list[list]]] = deque(maxlen=window)
+
+    def step(
+        self,
+        inputs: list[list],
+        lap: Optional[Callable[[str], None]] = None,
+    ) -> list[SimPlayer]:
+        """Advance the simulation by a tick, remembering it.
+
+        `lap`, if given, is called with "history" once the state is saved,
+        then as `Simulation.step` calls it.
+        """
+        if self.window:
+            self.history.append((self.simulation.to_state(), inputs))
+        if lap is not None:
+            lap("history")
+        removed = self.simulation.step(inputs, lap)
+        if removed:
+            self.history.clear()
+        return removed
+
+    def can_rewind(self, tick: int) -> bool:
+        """Check if the inputs of a past tick can still be added to."""
+        if not self.history:
+            return False
+        return self.history[0][0]["tick"] < tick <= self.simulation.tick
+
+    def rewind(self, late: list[list]) -> list[SimPlayer]:
+        """Add late inputs to past ticks and play those ticks again.
+
+        `late` holds [tick, input] pairs, for ticks `can_rewind` allows.
+        Returns the players removed while playing the ticks again.
+        """
+        first = min(tick for tick, _ in late)
+        history = list(self.history)
+        index = first - 1 - history[0][0]["tick"]
+        self.history = deque(history[:index], maxlen=self.window)
+        self.simulation = Simulation.from_state(history[index][0])
+        removed = []
+        for state, inputs in history[index:]:
+            tick = state["tick"] + 1
+            extra = [input for target, input in late if target == tick]
+            removed += self.step(inputs + extra)
+        return removed
@@ -0,0 +1,248 @@
+"""Connections over TCP, Unix domain sockets or within one process.
+
+Addresses are written like URLs: "tcp://host:port", "unix:///path/to/socket"
+or "inproc://name". A bare "host:port" is TCP. Unix sockets skip the TCP/IP
+stack for clients on the same machine, and in-process connections skip the
+kernel entirely, for bots and tests running in the server's process.
+
+`listen` and `connect` are the only places that know the transport. What
+they return is used like a socket, with `recv_into`, `sendall`,
+`settimeout`, `shutdown` and `close`.
+"""
+import itertools
+import os
+import queue
+import socket
+import stat
+import threading
+from typing import Optional, Union
+
+TCP = "tcp"
+UNIX = "unix"
+INPROC = "inproc"
+
+# Bytes an in-process connection holds before sending blocks, like a full
+# socket buffer.
+INPROC_BUFFER = 1024 * 1024
+
+# Listeners for in-process connections, by name.
+_inproc_listeners = {}
+_inproc_lock = threading.Lock()
+
+
+def parse(address: str) -> tuple[str, str]:
+    """Split an address into its transport and the rest."""
+    scheme, sep, rest = address.partition("://")
+    if not sep:
+        return TCP, address
+    if scheme not in (TCP, UNIX, INPROC):
+        raise ValueError(f"Unknown transport: {scheme}")
+    return scheme, rest
+
+
+def tcp_address(host: str, port: int) -> str:
+    """Make the address of a TCP host and port."""
+    return f"{TCP}://{host}:{port}"
+
+
+def host_port(address: str) -> tuple[str, int]:
+    """Get the host and port of a TCP address."""
+    scheme, rest = parse(address)
+    if scheme != TCP:
+        raise ValueError(f"Not a TCP address: {address}")
+    host, _, port = rest.rpartition(":")
+    return host, int(port)
+
+
+def remove_stale_socket(path: str, address: str):
+    """Remove a Unix socket left at a path by a server that crashed.
+
+    Anything else at the path, or a socket a server still accepts on, is
+    left alone and the address is in use.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"Address in use: {address}")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)  # Nothing is listening on it.
+        return
+    finally:
+        probe.close()
+    raise OSError(f"Address in use: {address}")
+
+
+class _Pipe:
+    """Bytes going one way between the ends of an in-process connection."""
+
+    def __init__(self):
+        """Set up an empty pipe."""
+        self.data = bytearray()
+        self.closed = False
+        self.changed = threading.Condition()
+
+    def write(self, data: bytes, timeout: Optional[float]):
+        """Add all the data, waiting while the pipe is full."""
+        view = memoryview(data)
+        with self.changed:
+            while view:
+                if not self.changed.wait_for(
+                    lambda: self.closed or len(self.data) < INPROC_BUFFER,
+                    timeout,
+                ):
+                    raise socket.timeout("timed out")
+                if self.closed:
+                    raise BrokenPipeError("Connection closed.")
+                size = INPROC_BUFFER - len(self.data)
+                self.data += view[:size]
+                view = view[size:]
+                self.changed.notify_all()
+
+    def read_into(self, buffer: memoryview, timeout: Optional[float]) -> int:
+        """Move waiting data into a buffer, 0 bytes once closed."""
+        with self.changed:
+            if not self.changed.wait_for(
+                lambda: self.closed or self.data, timeout
+            ):
+                raise socket.timeout("timed out")
+            size = min(len(buffer), len(self.data))
+            buffer[:size] = self.data[:size]
+            del self.data[:size]
+            self.changed.notify_all()
+            return size
+
+    def close(self):
+        """Stop the pipe, waking anyone waiting on it."""
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+
+class InprocConnection:
+    """One end of an in-process connection."""
+
+    def __init__(self, incoming: _Pipe, outgoing: _Pipe):
+        """Join the pipes to read from and write to."""
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.timeout = None
+
+    def settimeout(self, timeout: Optional[float]):
+        """Limit how long reads and writes wait, in seconds."""
+        self.timeout = timeout
+
+    def recv_into(self, buffer: memoryview) -> int:
+        """Read waiting bytes into a buffer, 0 once the peer is gone."""
+        return self.incoming.read_into(buffer, self.timeout)
+
+    def sendall(self, data: bytes):
+        """Send all the data to the other end."""
+        self.outgoing.write(data, self.timeout)
+
+    def shutdown(self, how: int):
+        """Stop both directions, waking the other end."""
+        self.incoming.close()
+        self.outgoing.close()
+
+    def close(self):
+        """Close the connection."""
+        self.shutdown(socket.SHUT_RDWR)
+
+
+Connection = Union[socket.socket, InprocConnection]
+
+
+class Listener:
+    """Accepts connections at an address."""
+
+    def __init__(self, address: str, timeout: Optional[float] = None):
+        """Start listening.
+
+        Accepting gives up after `timeout` seconds, so a server can check
+        whether it should stop.
+        """
+        self.address = address
+        self.scheme, self.target = parse(address)
+        self.timeout = timeout
+        self.peers = itertools.count(1)  # To name peers without an address.
+        self.socket = None
+        self.pending = None
+
+        if self.scheme == INPROC:
+            self.pending = queue.SimpleQueue()
+            with _inproc_lock:
+                if self.target in _inproc_listeners:
+                    raise OSError(f"Address in use: {address}")
+                _inproc_listeners[self.target] = self
+            return
+
+        if self.scheme == UNIX:
+            if not hasattr(socket, "AF_UNIX"):
+                raise ValueError("Unix sockets are not supported here.")
+            remove_stale_socket(self.target, address)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.bind(self.target)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(host_port(address))
+        self.socket.settimeout(timeout)
+        self.socket.listen()
+
+    def accept(self) -> tuple[Connection, str]:
+        """Wait for a connection, and name the peer for logs."""
+        if self.scheme == INPROC:
+            try:
+                conn = self.pending.get(timeout=self.timeout)
+            except queue.Empty:
+                raise socket.timeout("timed out")
+            return conn, f"{INPROC}:{next(self.peers)}"
+
+        conn, addr = self.socket.accept()
+        conn.settimeout(None)  # Don't inherit the accept timeout.
+        if self.scheme == UNIX:
+            return conn, f"{UNIX}:{next(self.peers)}"
+        host, port = addr[:2]
+        return conn, f"{host}:{port}"
+
+    def close(self):
+        """Stop listening."""
+        if self.scheme == INPROC:
+            with _inproc_lock:
+                _inproc_listeners.pop(self.target, None)
+            return
+        self.socket.close()
+        if self.scheme == UNIX and os.path.exists(self.target):
+            os.unlink(self.target)
+
+
+def listen(address: str, timeout: Optional[float] = None) -> Listener:
+    """Listen for connections at an address."""
+    return Listener(address, timeout)
+
+
+def connect(address: str, timeout: Optional[float] = None) -> Connection:
+    """Connect to a listener at an address."""
+    scheme, target = parse(address)
+    if scheme == INPROC:
+        with _inproc_lock:
+            listener = _inproc_listeners.get(target)
+        if listener is None:
+            raise ConnectionRefusedError(f"Nothing listening at {address}")
+        to_server, to_client = _Pipe(), _Pipe()
+        listener.pending.put(InprocConnection(to_server, to_client))
+        conn = InprocConnection(to_client, to_server)
+        conn.settimeout(timeout)
+        return conn
+
+    if scheme == UNIX:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(timeout)
+        conn.connect(target)
+        return conn
+    return socket.create_connection(host_port(address), timeout)
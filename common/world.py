@@ -0,0 +1,35 @@
+"""Sparse index of what occupies each cell of the board.
+
+Only occupied cells are stored, so memory use follows the number of snake
+segments and apples rather than the size of the board, and finding what is
+on a cell is a single dict lookup.
+"""
+
+
+class World:
+    """The occupied cells of the board."""
+
+    def __init__(self):
+        """Set up an empty world."""
+        # Map of (x, y) to the occupants of that cell.
+        self.cells: dict[tuple[int, int], list] = {}
+
+    def __contains__(self, position: tuple[int, int]) -> bool:
+        """Check if anything occupies a cell."""
+        return position in self.cells
+
+    def add(self, x: int, y: int, occupant: object):
+        """Add an occupant to a cell."""
+        self.cells.setdefault((x, y), []).append(occupant)
+
+    def remove(self, x: int, y: int, occupant: object):
+        """Remove an occupant from a cell, forgetting the cell if it empties."""
+        occupants = self.cells.get((x, y))
+        if occupants and occupant in occupants:
+            occupants.remove(occupant)
+            if not occupants:
+                del self.cells[(x, y)]
+
+    def at(self, x: int, y: int) -> list:
+        """Get the occupants of a cell."""
+        return self.cells.get((x, y), [])
@@ -1,2 +1,14 @@
 """The API server for the snake game."""
-from .__main__ import Server  # noqa: F401
+
+
+def __getattr__(name: str) -> object:
+    """Import `Server` only once it's used.
+
+    This keeps `server.config` cheap to import, for clients that only want
+    the default settings.
+    """
+    if name == "Server":
+        from .core import Server
+
+        return Server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
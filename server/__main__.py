@@ -1,280 +1,92 @@
-"""Entrypoint for the server."""
+"""Entrypoint for the headless server.
+
+Only server code is imported, so this runs without a terminal. Settings are
+read with `server.config.load_config`.
+"""
+import argparse
 import logging
-import socket
+import signal
+import sys
 import threading
 import time
-from threading import Thread
-from typing import Any
-
-import msgpack
-
-from common import logic, models
-
-logger = logging.getLogger("snake.server")
-logging.basicConfig(level=logging.INFO)
-
-
-class Player(Thread):
-    """Class for each client."""
-
-    def __init__(
-        self,
-        conn: socket.socket,
-        addr: tuple[str, int],
-        model: models.Player,
-    ):
-        """Set up the client."""
-        super().__init__()
-        self.segments = []
-        self.game = None
-        self.server = None
-        self.player_model = model
-        for _ in range(0, logic.STARTING_SNAKE_SEGMENTS):
-            logic.add_segment(self.segments, id=self.player_model.id)
-        self.terminate_flag = threading.Event()
-        self.conn = conn
-        self.addr = addr  # Host, port.
-        self.direction = logic.RIGHT
-
-    def send(self, data: dict):
-        """Pack and send data to the player."""
-        try:
-            packed = msgpack.packb(data, use_bin_type=True)  # pack the data
-            self.conn.sendall(packed)
-        except (BrokenPipeError, IOError):
-            pass
-
-    def handler(self, data: dict[str, Any]):
-        """Handle different types of events from client."""
-        if "event" in data:
-            event = data["event"]
-            data = event["data"]
-            type = event["type"]
-
-            if type == "nick":
-                if len(data) > 8:
-                    self.kill()  # nickname protection
-                else:
-                    self.player_model.name = data
-            if type == "dir":
-                self.direction = tuple(data)
-
-    def kill(self):
-        """Send player the msg to disconnect."""
-        self.segments = []
-        self.send({"event": {"type": "dead", "data": self.player_model.score}})
-        del self.game.players[self.game.players.index(self)]
-        del self.game.apples[0]
-        del self.server.clients[self.server.clients.index(self)]
-        self.stop()
-
-    def stop(self):
-        """Stop thread."""
-        self.terminate_flag.set()
-        self.conn.close()
-
-    def run(self):
-        """Listen for events."""
-        unpacker = msgpack.Unpacker(raw=False)
-        while not self.terminate_flag.is_set():
-            try:
-                r = self.conn.recv(1024)
-                if r:
-                    unpacker.feed(r)
-                    for i in unpacker:
-                        self.handler(i)
-            except Exception as e:
-                if e is socket.timeout:
-                    pass  # ignore socket timeouts, the connection shouldnt stop
-                else:
-                    self.terminate_flag.set()
-
-
-class Game(Thread):
-    """Game or match filled with players."""
-
-    def __init__(self, config: dict):
-        """Initialize game class."""
-        super().__init__()
-        self.info = models.ServerInfo(
-            name=config["SERVER_NAME"],
-            version=config["GAME_VERSION"],
-            width=config["BOX_WIDTH"],
-            height=config["BOX_HEIGHT"],
-        )
-        self.config = config
-        self.starting_apples = 2
-
-        self.players = []
-        self.apples = []
-        self.entities = []
-        self.tickrate = config["TICKRATE"]
-        self.terminate_flag = threading.Event()
-
-    @property
-    def full(self) -> bool:
-        """Check if the game is full."""
-        return len(self.players) >= self.config["MAX_PLAYERS"]
 
-    def add_player(self, player: Player):
-        """Add a player to the current game."""
-        self.players.append(player)
-        player.game = self
-        self.apples.append(
-            logic.create_apple(
-                (self.info.width, self.info.height), self.entities
-            )
-        )
+from common import transport
 
-    def stop(self):
-        """Stop thread."""
-        self.terminate_flag.set()
+from .config import load_config, parse_address
+from .core import Server
 
-    @property
-    def game_model(self) -> models.Game:
-        """Collate game data in to a data model."""
-        # Collate players and entities.
-        player_models = []
-        entities = []
-        for player in self.players:
-            player_models.append(player.player_model)
-            entities.extend(player.segments)
-        entities.extend(self.apples)
-        # Create the model.
-        return models.Game(
-            players=player_models,
-            entities=entities,
-            meta=self.info,
-        )
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
 
-    def run(self):
-        """Run the game mainloop."""
-        current_time = last_frame_time = time.time()
-
-        for i in range(1, self.starting_apples):
-            self.apples.append(
-                logic.create_apple(
-                    (self.info.width, self.info.height), self.entities
-                )
-            )  # create new apple
-
-        while True:
-            # Calculations needed for maintaining stable FPS
-            sleep_time = 1 / self.tickrate - (current_time - last_frame_time)
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-
-            # Update snake segments
-            for player in self.players:
-                logic.move(player.direction, player.segments)  # move players
-
-                # check for collisions
-                if logic.has_collided_with_wall(
-                    self.info.width, self.info.height, player.segments
-                ) or logic.has_collided_with_self(player.segments):
-                    player.kill()
-
-                # check if player has collided with other player
-                for other in self.players:
-                    if logic.has_collided_with_others(
-                        player.segments, other.segments
-                    ):
-                        player.kill()
-                        other.player_model.score += player.player_model.score
-                        for i in range(1, other.player_model.score // 2):
-                            logic.add_segment(
-                                other.segments, id=other.player_model.id
-                            )
-
-                # add al players to entities, used for apple checks
-                self.entities.extend(player.segments)
-
-                for apple in self.apples:  # check if player eats apple
-                    if logic.check_apple(player.segments, apple):
-                        player.player_model.score += 1
-                        logic.add_segment(
-                            player.segments, id=player.player_model.id
-                        )
-                        del self.apples[self.apples.index(apple)]
-                        self.apples.append(
-                            logic.create_apple(
-                                (self.info.width, self.info.height),
-                                self.entities,
-                            )
-                        )  # create new apple
-
-            # Send players game data
-            game_data = self.game_model.dict()
-            for player in self.players:
-                player.send(game_data)
-
-
-class Server(Thread):
-    """Game server process."""
-
-    def __init__(self, config: dict, host: str = "", port: int = 65444):
-        """Set up the game server."""
-        super().__init__()
-        self.terminate_flag = threading.Event()
-
-        self.host = host
-        self.port = port
-
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((self.host, self.port))
-        self.socket.settimeout(10)
-        self.socket.listen()
-
-        self.game_config = config
-        self.clients = []
-        self.games = []
-        self.next_player_id = 1
-
-    def on_connect(self, conn: socket.socket, addr: tuple[str, int]):
-        """Handle a new connection to the server."""
-        host, port = addr
-        logger.info(f"New client connected: {host}:{port}.")
-        client = Player(
-            conn,
-            addr,
-            models.Player(id=self.next_player_id, name="Unamed Player", score=0),
-        )
-        client.server = self
-        self.next_player_id += 1
-        self.clients.append(client)
-        client.start()
-
-        for game in self.games:
-            if not game.full:
-                game.add_player(client)
-                return
-        # No game was found.
-        new_game = Game(self.game_config)
-        self.games.append(new_game)
-        new_game.add_player(client)
-        new_game.start()
-
-    def stop(self):
-        """Stop the server."""
-        self.terminate_flag.set()
+logger = logging.getLogger("snake.server")
 
-    def run(self):
-        """Run the server and wait for connections."""
-        logger.info(f"Server listing on {self.host}:{self.port}.")
-        while not self.terminate_flag.is_set():
-            try:
-                conn, addr = self.socket.accept()
-                self.on_connect(conn, addr)
-            except (BrokenPipeError, IOError, socket.timeout):
-                pass  # meaningless errors, prevent crash
 
-        # Stop everything.
-        for thread in (*self.clients, *self.games):
-            thread.stop()
-            thread.join()
+def max_memory() -> str:
+    """Describe the peak memory use of the process."""
+    if resource is None:
+        return "unknown"
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        usage *= 1024  # Linux reports kibibytes, macOS bytes.
+    return f"{usage / 2 ** 20:.1f} MiB"
+
+
+def main():
+    """Load settings and run the server until interrupted."""
+    parser = argparse.ArgumentParser(description="Run a snake game server.")
+    parser.add_argument("-c", "--config", help="path to a JSON settings file")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="start up, report startup time and memory, then exit",
+    )
+    parser.add_argument(
+        "--restore",
+        metavar="PATH",
+        help="carry on the games in a checkpoint file",
+    )
+    parser.add_argument(
+        "--drain-to",
+        metavar="ADDRESS",
+        help="on exit, move games and players to the server at ADDRESS",
+    )
+    args = parser.parse_args()
+    config = load_config(args.config)
+
+    gateway = parse_address(config["GATEWAY"]) if config["GATEWAY"] else None
+    address = config["ADDRESS"] or transport.tcp_address(
+        config["HOST"], config["PORT"]
+    )
+    server = Server(config, address, gateway)
+    if args.restore:
+        server.restore(args.restore)
+    server.start()
+    # Stop the same way on SIGTERM as on Ctrl+C, so games can be drained.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # Log the games' profiles on SIGUSR1, from this thread, outside of the
+    # handler. Not available on Windows.
+    dump = threading.Event()
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump.set())
+    # Process time covers the interpreter starting and every import.
+    startup = time.process_time() * 1000
+    logger.info(f"Started in {startup:.1f} ms of CPU time, {max_memory()}.")
+
+    try:
+        while server.is_alive() and not args.check:
+            server.join(1)
+            if dump.is_set():
+                dump.clear()
+                server.dump_profiles()
+    except KeyboardInterrupt:
+        pass
+    if args.drain_to:
+        server.drain(args.drain_to, config["CHECKPOINT_PATH"])
+    server.stop()
+    server.join()
 
 
 if __name__ == "__main__":
-    serv = Server()
-    serv.start()
+    main()
@@ -0,0 +1,109 @@
+"""Deciding whether the server can take on another player.
+
+New players are only put in a game while the server has room for them, so
+games already running keep their tickrate however many people try to join.
+The server is busy while any of these hold:
+
+ - MAX_TOTAL_PLAYERS players are in games.
+ - MAX_GAMES games are running and all of them are full.
+ - The games' loads add up to more than MAX_LOAD. A game's load is the
+   fraction of its tick interval spent working, and games share one core
+   because of the GIL, so over 1 means ticks are running late.
+ - More than MAX_BACKLOG messages are queued to be sent to clients.
+
+Players also get in at no more than JOIN_RATE a second, as a game's load
+only shows a new player a second or so after they join. Players who say
+hello while the server is busy, or while others are waiting, wait in line,
+up to WAITING_ROOM of them, and are told where they are in it. Past that,
+and once MAX_CONNECTIONS clients are connected, they are turned away.
+"""
+from collections import deque
+from typing import Optional
+
+from .metrics import Metrics
+from .ratelimit import TokenBucket
+
+# Reasons the server is busy.
+PLAYERS = "players"
+GAMES = "games"
+LOAD = "load"
+BACKLOG = "backlog"
+RATE = "rate"
+LINE = "line"  # Others are waiting already.
+CONNECTIONS = "connections"
+
+
+def busy_event(reason: str, position: Optional[int] = None) -> dict:
+    """Make the event telling a client the server is busy.
+
+    The position is theirs in the line, or None if they were turned away.
+    """
+    return {
+        "event": {
+            "type": "busy",
+            "data": {"reason": reason, "position": position},
+        }
+    }
+
+
+class Admission:
+    """Tracks the limits on new players, and the line of those waiting."""
+
+    def __init__(self, config: dict, metrics: Metrics):
+        """Read the limits from the server config."""
+        self.metrics = metrics
+        self.max_connections = config.get("MAX_CONNECTIONS", 256)
+        self.max_total_players = config.get("MAX_TOTAL_PLAYERS", 100)
+        self.max_games = config.get("MAX_GAMES", 20)
+        self.max_load = config.get("MAX_LOAD", 0.8)
+        self.max_backlog = config.get("MAX_BACKLOG", 2000)
+        join_rate = config.get("JOIN_RATE", 10)
+        self.joins = TokenBucket(join_rate, join_rate)
+        self.waiting_room = config.get("WAITING_ROOM", 20)
+        self.waiting = deque()  # Players in line, first to get in first.
+
+    def busy(self, games: list, clients: list) -> Optional[str]:
+        """Get why the server can't take another player, if it can't."""
+        if sum(game.seats for game in games) >= self.max_total_players:
+            return PLAYERS
+        if len(games) >= self.max_games and all(game.full for game in games):
+            return GAMES
+        load = sum(game.load for game in games)
+        self.metrics.set("admission.load", load)
+        if load > self.max_load:
+            return LOAD
+        backlog = sum(client.outbox.backlog for client in clients)
+        self.metrics.set("admission.backlog", backlog)
+        if backlog > self.max_backlog:
+            return BACKLOG
+        if not self.joins.take():
+            return RATE
+        return None
+
+    def enqueue(self, client: object) -> Optional[int]:
+        """Put a player in line, giving their place, or None if it's full."""
+        if client not in self.waiting:
+            if len(self.waiting) >= self.waiting_room:
+                return None
+            self.waiting.append(client)
+            self.metrics.set("admission.waiting", len(self.waiting))
+        return self.waiting.index(client) + 1
+
+    def next(self) -> object:
+        """Take the player at the front of the line."""
+        client = self.waiting.popleft()
+        self.metrics.set("admission.waiting", len(self.waiting))
+        return client
+
+    def prune(self):
+        """Forget players who left the line."""
+        self.waiting = deque(
+            client
+            for client in self.waiting
+            if not client.terminate_flag.is_set()
+        )
+
+    def refuse(self, reason: str) -> dict:
+        """Count a player turned away, and make the event telling them."""
+        self.metrics.log("admission_refused", reason=reason)
+        return busy_event(reason)
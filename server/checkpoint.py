@@ -0,0 +1,69 @@
+"""Saving games so another server process can carry them on.
+
+A checkpoint holds, for each game, its simulation state, tickrate and a
+resume token for every player. The state includes the seed and the number
+of apples made, which is all the randomness there is, so the restored game
+plays on exactly as the original would have. Checkpoints are packed with
+msgpack and compressed with zlib.
+
+Players are sent their token in a "migrate" event, and say hello to the new
+server with it to get their snake back. Players who had no snake yet, like
+those waiting in line, are sent no token and join a game there.
+"""
+import os
+import secrets
+import zlib
+from typing import Optional
+
+import msgpack
+
+VERSION = 1
+
+
+def new_token() -> str:
+    """Make a token a player can resume with."""
+    return secrets.token_urlsafe(16)
+
+
+def migrate_event(address: str, token: Optional[str] = None) -> dict:
+    """Make the event telling a player to reconnect to another server."""
+    return {
+        "event": {
+            "type": "migrate",
+            "data": {"address": address, "token": token},
+        }
+    }
+
+
+def pack(games: list[dict]) -> bytes:
+    """Pack checkpoints of games."""
+    data = msgpack.packb({"version": VERSION, "games": games})
+    return zlib.compress(data, 1)
+
+
+def unpack(data: bytes) -> list[dict]:
+    """Unpack checkpoints of games."""
+    checkpoint = msgpack.unpackb(zlib.decompress(data), raw=False)
+    if checkpoint.get("version") != VERSION:
+        raise ValueError(f"Unknown checkpoint version: {checkpoint['version']}")
+    return checkpoint["games"]
+
+
+def save(path: str, games: list[dict]) -> int:
+    """Write a checkpoint file, returning its size.
+
+    The file is replaced in one step, so a server restoring from it never
+    reads half of it.
+    """
+    data = pack(games)
+    partial = path + ".partial"
+    with open(partial, "wb") as f:
+        f.write(data)
+    os.replace(partial, path)
+    return len(data)
+
+
+def load(path: str) -> list[dict]:
+    """Read a checkpoint file."""
+    with open(path, "rb") as f:
+        return unpack(f.read())
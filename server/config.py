@@ -0,0 +1,109 @@
+"""Server settings, loaded from a JSON file and the environment.
+
+Settings come from `DEFAULTS`, then the JSON file if one is given, then any
+`SNAKE_<SETTING>` environment variables, each overriding the last.
+"""
+import json
+import logging
+import os
+from typing import Mapping, Optional
+
+logger = logging.getLogger("snake.server.config")
+
+ENV_PREFIX = "SNAKE_"
+
+DEFAULTS = {
+    # Address to listen on.
+    "HOST": "",
+    "PORT": 65444,
+    # Listen here instead of HOST and PORT, with any transport, like
+    # "unix:///tmp/snake.sock" for players on this machine.
+    "ADDRESS": "",
+    # Game settings.
+    "SERVER_NAME": "SnekBox",
+    "GAME_VERSION": 0,
+    "BOX_WIDTH": 128,
+    "BOX_HEIGHT": 32,
+    "TICKRATE": 15,
+    # Lower the tickrate, down to MIN_TICKRATE, while the host is overloaded.
+    "ADAPTIVE_TICKRATE": False,
+    "MIN_TICKRATE": 5,
+    "MAX_PLAYERS": 5,
+    # Limits on new players, see server/admission.py. Existing games keep
+    # their tickrate while players wait in line or are turned away.
+    "MAX_CONNECTIONS": 256,
+    "MAX_TOTAL_PLAYERS": 100,
+    "MAX_GAMES": 20,
+    "MAX_LOAD": 0.8,
+    "MAX_BACKLOG": 2000,
+    "JOIN_RATE": 10,
+    "WAITING_ROOM": 20,
+    # Ticks back a late turn can still be applied on the tick it was meant
+    # for. 0 applies every turn on the next tick.
+    "REWIND_TICKS": 4,
+    "TOP_PLAYERS": 10,
+    # Events a client may send per second, and in a burst. Clients going
+    # over the limit by INPUT_ABUSE_LIMIT events in a second are dropped.
+    "INPUT_RATE": 20,
+    "INPUT_BURST": 40,
+    "INPUT_ABUSE_LIMIT": 200,
+    # Time each phase of every tick.
+    "PROFILE": False,
+    "LEADERBOARD_PATH": "leaderboard.sqlite3",
+    # Where games are saved when draining to another server, and how long,
+    # in seconds, a restored game waits for its players to come back.
+    "CHECKPOINT_PATH": "checkpoint.bin",
+    "RESUME_TIMEOUT": 30,
+    # Directory to write each game's frames to, as a ring of FRAME_RING_SLOTS
+    # slots of FRAME_RING_SLOT_SIZE bytes, for other processes on this
+    # machine to read. See common/framering.py. Games build a frame every
+    # tick for the ring, even when all their players are in lockstep and
+    # would otherwise not need one.
+    "FRAME_RING_DIR": "",
+    "FRAME_RING_SLOTS": 64,
+    "FRAME_RING_SLOT_SIZE": 65536,
+    # Gateway to register with, as "host:port", if any.
+    "GATEWAY": "",
+    "GATEWAY_TOKEN": "",
+    # Host players should use to reach this server through a gateway.
+    "PUBLIC_HOST": "",
+}
+
+
+def _convert(key: str, value: str) -> object:
+    """Convert a setting from the environment to the type of its default."""
+    default = DEFAULTS[key]
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def load_config(
+    path: Optional[str] = None, environ: Mapping[str, str] = os.environ
+) -> dict:
+    """Load the server settings."""
+    config = dict(DEFAULTS)
+    if path:
+        with open(path, "r") as f:
+            config.update(json.load(f))
+    for key in DEFAULTS:
+        value = environ.get(ENV_PREFIX + key)
+        if value is not None:
+            config[key] = _convert(key, value)
+
+    unknown = sorted(config.keys() - DEFAULTS.keys())
+    if unknown:
+        logger.warning(f"Ignoring unknown settings: {', '.join(unknown)}.")
+        for key in unknown:
+            del config[key]
+    return config
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """Split a "host:port" address."""
+    host, _, port = address.rpartition(":")
+    return host, int(port)
@@ -0,0 +1,954 @@
+"""Players, games and the server accepting connections."""
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from collections import deque
+from threading import Thread
+from typing import Any, Optional
+
+import msgpack
+
+from common import compression, logic, models, transport
+from common.framering import FrameRingWriter
+from common.receiver import MAX_CLIENT_MESSAGE, MessageError, Receiver
+from common.simulation import HASH_INTERVAL, SimPlayer, Simulation, Timeline
+
+from . import admission, checkpoint, profiling
+from .gateway import GatewayLink
+from .leaderboard import UNNAMED, Leaderboard
+from .metrics import Metrics
+from .outbox import Outbox
+from .pipeline import FramePipeline
+from .ranking import Ranking
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger("snake.server")
+logging.basicConfig(level=logging.INFO)
+
+# Turns a player can have waiting for the coming ticks.
+TURN_BUFFER = 2
+
+
+def server_info(config: dict) -> models.ServerInfo:
+    """Get the metadata clients are sent from the server settings."""
+    return models.ServerInfo(
+        name=config["SERVER_NAME"],
+        version=config["GAME_VERSION"],
+        width=config["BOX_WIDTH"],
+        height=config["BOX_HEIGHT"],
+    )
+
+
+class Player(Thread):
+    """Class for each client."""
+
+    def __init__(
+        self,
+        conn: transport.Connection,
+        peer: str,
+        model: models.Player,
+        metrics: Metrics,
+        config: dict,
+    ):
+        """Set up the client."""
+        super().__init__()
+        self.game = None
+        self.server = None
+        self.player_model = model
+        self.terminate_flag = threading.Event()
+        self.conn = conn
+        self.peer = peer  # Named for logs, like "host:port".
+        self.metrics = metrics
+        self.receiver = Receiver(conn, MAX_CLIENT_MESSAGE)
+        self.outbox = Outbox(conn, metrics, peer)
+        # Frames are only sent once compression is negotiated and, for
+        # streaming modes, once a keyframe has been reached.
+        self.compression = compression.NONE
+        self.synced = False
+        # Lockstep players are sent inputs to simulate instead of frames.
+        self.lockstep = False
+
+        self.limiter = TokenBucket(
+            config.get("INPUT_RATE", 20), config.get("INPUT_BURST", 40)
+        )
+        self.abuse_limit = config.get("INPUT_ABUSE_LIMIT", 200)
+        self.dropped = 0  # Events over the rate limit.
+        self.recent_drops = 0  # In the second since drop_window.
+        self.drop_window = 0.0
+        # Turns waiting for the next ticks, one applied per tick.
+        self.turns = deque()
+        self.turns_lock = threading.Lock()
+        self.coalesced = 0  # Turns replaced or dropped as redundant.
+        # Tick the last turn was applied on. Later turns go on later ticks.
+        self.turn_tick = 0
+
+    def send(self, data: dict):
+        """Pack and send data to the player."""
+        self.send_packed(msgpack.packb(data, use_bin_type=True))
+
+    def send_packed(self, packed: bytes):
+        """Queue already packed data to be sent to the player.
+
+        Players too far behind to take any more are made to leave.
+        """
+        if not self.outbox.put(packed) and not self.terminate_flag.is_set():
+            self.leave()
+
+    def handler(self, data: dict[str, Any]):
+        """Handle different types of events from client."""
+        if "event" in data:
+            if not self.allow_event():
+                return
+            event = data["event"]
+            data = event["data"]
+            type = event["type"]
+
+            if type == "hello" and self.game is None:
+                self.compression = compression.negotiate(
+                    data.get("compression", [])
+                )
+                self.lockstep = bool(data.get("lockstep", False))
+                self.send(
+                    {
+                        "event": {
+                            "type": "hello",
+                            "data": {
+                                "compression": self.compression,
+                                "lockstep": self.lockstep,
+                                "meta": server_info(
+                                    self.server.game_config
+                                ).dict(),
+                            },
+                        }
+                    }
+                )
+                token = data.get("resume")
+                # Players moved here from another server get their snake
+                # back, or a new one if the token is no good.
+                if not (
+                    isinstance(token, str) and self.server.resume(self, token)
+                ):
+                    self.server.join_game(self)
+            if type == "leaderboard":
+                if not (
+                    isinstance(data, dict)
+                    and isinstance(data.get("name"), str)
+                ):
+                    return
+                leaderboard = self.server.leaderboard
+                self.send(
+                    {
+                        "event": {
+                            "type": "leaderboard",
+                            "data": {
+                                "top": leaderboard.top(),
+                                "rank": leaderboard.rank(data["name"]),
+                            },
+                        }
+                    }
+                )
+            if type == "dir":
+                self.queue_turn(data)
+            elif type in ("nick", "resync") and self.game is not None:
+                # Applied by the game at the start of its next tick.
+                self.game.submit(self, type, data)
+            elif type == "nick":
+                if len(data) > 8:
+                    self.stop()  # nickname protection
+                else:
+                    self.player_model.name = data
+            if type == "pong":
+                self.outbox.on_pong(data)
+
+    def allow_event(self) -> bool:
+        """Check an event is within the rate limit.
+
+        Clients that keep sending far too many events are disconnected.
+        """
+        if self.limiter.take():
+            return True
+        self.dropped += 1
+        self.metrics.incr("input.dropped")
+        now = time.monotonic()
+        if now - self.drop_window >= 1:
+            self.drop_window = now
+            self.recent_drops = 0
+        self.recent_drops += 1
+        if self.recent_drops > self.abuse_limit:
+            if not self.terminate_flag.is_set():
+                self.metrics.log(
+                    "input_abuse",
+                    client=self.outbox.client,
+                    dropped=self.dropped,
+                )
+                self.leave()
+        return False
+
+    def queue_turn(self, data: object):
+        """Queue a turn for the coming ticks.
+
+        Turns are sent as a direction, or as {"direction": ..., "tick": ...}
+        with the tick the client meant the turn for. The buffer holds
+        TURN_BUFFER turns, so two quick turns still take effect on
+        consecutive ticks. Later turns replace the last one, and repeats of
+        the last one are dropped.
+        """
+        tick = None
+        if isinstance(data, dict):
+            tick = data.get("tick")
+            data = data.get("direction")
+            if not isinstance(tick, int):
+                tick = None
+        if not isinstance(data, list) or tuple(data) not in logic.DIRECTIONS:
+            return
+        turn = (tuple(data), tick)
+        with self.turns_lock:
+            coalesced = True
+            if self.turns and self.turns[-1][0] == turn[0]:
+                pass
+            elif len(self.turns) >= TURN_BUFFER:
+                self.turns[-1] = turn
+            else:
+                self.turns.append(turn)
+                coalesced = False
+        if coalesced:
+            self.coalesced += 1
+            self.metrics.incr("input.coalesced")
+
+    def next_turn(self) -> Optional[tuple[tuple[int, int], Optional[int]]]:
+        """Take the turn for the next tick, and the tick it was meant for."""
+        with self.turns_lock:
+            return self.turns.popleft() if self.turns else None
+
+    def kill(self):
+        """Send player the msg to disconnect.
+
+        The game must have removed the player already.
+        """
+        self.send({"event": {"type": "dead", "data": self.player_model.score}})
+        self.server.leaderboard.record(
+            self.player_model.name, self.player_model.score
+        )
+        self.server.remove_client(self)
+        self.stop()
+
+    def stop(self):
+        """Stop thread, once everything queued is sent."""
+        self.terminate_flag.set()
+        self.outbox.close()
+
+    def leave(self):
+        """Leave the server, and the game if in one."""
+        if self.game is None:
+            # Closed before joining a game, like after a query.
+            self.server.remove_client(self)
+        else:
+            self.game.submit(self, "leave")
+        self.stop()
+
+    def run(self):
+        """Listen for events."""
+        self.outbox.start()
+        while not self.terminate_flag.is_set():
+            try:
+                messages = self.receiver.receive()
+                if messages is None:
+                    self.leave()
+                else:
+                    for i in messages:
+                        self.handler(i)
+            except MessageError as e:
+                logger.warning(f"Bad message from {self.peer}: {e}")
+                self.leave()
+            except Exception as e:
+                if isinstance(e, socket.timeout):
+                    pass  # ignore socket timeouts, the connection shouldnt stop
+                else:
+                    logger.warning(f"Error handling {self.peer}: {e!r}")
+                    self.leave()
+
+        receiver = self.receiver
+        self.metrics.incr("recv.reads", receiver.reads)
+        self.metrics.incr("recv.bytes", receiver.received)
+        self.metrics.incr("recv.allocations", receiver.allocations)
+
+
+class Game(Thread):
+    """Game or match filled with players.
+
+    Only the game's own thread changes its state. Other threads submit
+    commands, which become the inputs of the next tick. The rules are in
+    `common.simulation`, so lockstep players can run them too: they are
+    sent each tick's inputs instead of frames, and a state hash now and
+    then to check they are in sync.
+    """
+
+    def __init__(
+        self, config: dict, metrics: Metrics, saved: Optional[dict] = None
+    ):
+        """Initialize game class.
+
+        A game saved with `checkpoint` carries on from where it was, paused
+        until its players resume or RESUME_TIMEOUT passes.
+        """
+        super().__init__()
+        self.metrics = metrics
+        self.info = server_info(config)
+        self.config = config
+        self.starting_apples = 2
+
+        self.players: dict[int, Player] = {}
+        if saved is None:
+            simulation = Simulation(
+                self.info.width, self.info.height, random.getrandbits(32)
+            )
+            for i in range(1, self.starting_apples):
+                simulation.add_apple()
+        else:
+            simulation = Simulation.from_state(saved["state"])
+        # Late turns are applied on the tick they were meant for, if it was
+        # at most REWIND_TICKS ago.
+        self.timeline = Timeline(simulation, config.get("REWIND_TICKS", 4))
+        self.commands = queue.SimpleQueue()  # (player, type, data)
+        # Players added, including those whose join is still queued.
+        self.seats = len(simulation.players)
+        self.seats_lock = threading.Lock()
+        # Resume tokens of players yet to come back from a checkpoint, to
+        # their ids, and the ids of those who didn't make it in time.
+        self.awaiting: dict[str, int] = {}
+        self.expired: list[int] = []
+        self.resume_deadline = 0.0
+        self.newcomers: list[Player] = []  # Joining as it was checkpointed.
+        self.tickrate = config["TICKRATE"]
+        if saved is not None:
+            self.awaiting = dict(saved["tokens"])
+            self.resume_deadline = time.monotonic() + config.get(
+                "RESUME_TIMEOUT", 30
+            )
+            self.tickrate = saved["tickrate"]
+        # Fraction of the time between ticks spent working, smoothed.
+        self.load = 0.0
+        self.last_adapt = time.monotonic()
+        self.ranking = Ranking()
+        self.sent_ranking = -1  # Version of the ranking last sent.
+        self.top_players = config.get("TOP_PLAYERS", 10)
+        self.terminate_flag = threading.Event()
+        profile = config.get("PROFILE", False)
+        if profile:
+            self.profiler = profiling.TickProfiler(profiling.GAME_PHASES)
+        else:
+            self.profiler = profiling.NullProfiler()
+        ring = None
+        if config.get("FRAME_RING_DIR"):
+            # Named after the process too, so servers sharing the directory
+            # don't write to each other's rings.
+            path = os.path.join(
+                config["FRAME_RING_DIR"],
+                f"snake-{os.getpid()}-{self.name}.ring",
+            )
+            ring = FrameRingWriter(
+                path,
+                config.get("FRAME_RING_SLOTS", 64),
+                config.get("FRAME_RING_SLOT_SIZE", 65536),
+            )
+            logger.info(f"Writing frames of {self.name} to {path}.")
+        self.pipeline = FramePipeline(
+            f"{self.name}-frames", self.metrics, profile, ring
+        )
+
+    @property
+    def simulation(self) -> Simulation:
+        """Get the simulation at the current tick."""
+        return self.timeline.simulation
+
+    @property
+    def tick(self) -> int:
+        """Get the number of ticks simulated."""
+        return self.simulation.tick
+
+    @property
+    def full(self) -> bool:
+        """Check if the game is full."""
+        return self.seats >= self.config["MAX_PLAYERS"]
+
+    def add_player(self, player: Player):
+        """Add a player to the game at the start of the next tick."""
+        with self.seats_lock:
+            self.seats += 1
+        player.game = self
+        self.submit(player, "join")
+
+    def resume(self, player: Player, token: str) -> bool:
+        """Give a player back their snake from a checkpoint, if it's theirs.
+
+        The game takes them in at the start of the next tick.
+        """
+        with self.seats_lock:
+            id = self.awaiting.pop(token, None)
+        if id is None:
+            return False
+        saved = self.simulation.players[id]
+        player.player_model.id = id
+        player.player_model.name = saved.name
+        player.player_model.score = saved.score
+        player.game = self
+        self.submit(player, "resume")
+        return True
+
+    def paused(self) -> bool:
+        """Check if the game is waiting for players to resume.
+
+        Once RESUME_TIMEOUT passes, the snakes of players still missing are
+        removed on the next tick.
+        """
+        with self.seats_lock:
+            if not self.awaiting:
+                return False
+            if time.monotonic() < self.resume_deadline:
+                return True
+            self.expired = list(self.awaiting.values())
+            self.awaiting.clear()
+        self.metrics.log("resume_expired", game=self.name, players=self.expired)
+        return False
+
+    def checkpoint(self) -> dict:
+        """Save the game, with a new resume token for each player.
+
+        Only call this once the game's thread has stopped. Players whose join
+        was still queued have no snake to save, and are kept to be sent on
+        by `migrate`. Players who were leaving, or didn't come back from an
+        earlier checkpoint in time, are removed, so the restored game
+        doesn't wait for them. Those still in time keep their tokens.
+        """
+        self.newcomers = []
+        leaving = list(self.expired)
+        self.expired = []
+        while True:
+            try:
+                player, type, _ = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if type == "join":
+                self.newcomers.append(player)
+            elif type == "resume":
+                self.players[player.player_model.id] = player
+            elif type == "leave":
+                leaving.append(player.player_model.id)
+        for id in leaving:
+            if id in self.simulation.players:
+                self.remove_player(self.simulation.remove(id))
+        tokens = {checkpoint.new_token(): id for id in self.players}
+        tokens.update(self.awaiting)
+        self.awaiting = tokens
+        return {
+            "state": self.simulation.to_state(),
+            "tickrate": self.tickrate,
+            "tokens": tokens,
+        }
+
+    def migrate(self, address: str):
+        """Send the players of a checkpointed game to another server."""
+        for token, id in self.awaiting.items():
+            player = self.players.get(id)
+            if player is not None:
+                player.send(checkpoint.migrate_event(address, token))
+                player.stop()
+        for player in self.newcomers:
+            if not player.terminate_flag.is_set():
+                player.send(checkpoint.migrate_event(address))
+                player.stop()
+
+    def submit(self, player: Player, type: str, data: object = None):
+        """Queue a command from a player for the next tick."""
+        self.commands.put((player, type, data))
+
+    def collect_inputs(self) -> tuple[list[list], list[list], list[Player]]:
+        """Turn the commands queued since the last tick into inputs.
+
+        Also returns late turns, as [tick, input] pairs for ticks that can
+        be played again, and the lockstep players who need the whole state.
+        """
+        inputs = [["leave", id, None] for id in self.expired]
+        self.expired = []
+        late = []
+        syncs = []
+        while True:
+            try:
+                player, type, data = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            id = player.player_model.id
+            if type == "join":
+                self.players[id] = player
+                inputs.append(["join", id, player.player_model.name])
+                if player.lockstep:
+                    syncs.append(player)
+            elif type == "resume":
+                self.players[id] = player  # Their snake is already here.
+                if player.lockstep:
+                    syncs.append(player)
+            elif id not in self.players:
+                continue  # Already gone.
+            elif type == "leave":
+                inputs.append(["leave", id, None])
+            elif type == "nick":
+                if not isinstance(data, str) or len(data) > 8:
+                    inputs.append(["leave", id, None])  # nickname protection
+                else:
+                    player.player_model.name = data
+                    inputs.append(["nick", id, data])
+            elif type == "resync" and player.lockstep:
+                syncs.append(player)
+
+        # One turn per player per tick. A turn never goes on a tick at or
+        # before the one the player's last turn went on, so quick turns
+        # meant for the same tick land on consecutive ones.
+        for id, player in self.players.items():
+            turn = player.next_turn()
+            if turn is None:
+                continue
+            direction, target = turn
+            input = ["dir", id, list(direction)]
+            if target is not None:
+                target = max(target, player.turn_tick + 1)
+            if target is None or target > self.tick:
+                inputs.append(input)
+                player.turn_tick = self.tick + 1
+            elif self.timeline.can_rewind(target):
+                late.append([target, input])
+                player.turn_tick = target
+                self.metrics.incr("input.rewound")
+            else:
+                inputs.append(input)  # Too late to rewind, so apply it now.
+                player.turn_tick = self.tick + 1
+                self.metrics.incr("input.too_late")
+        return inputs, late, syncs
+
+    def remove_player(self, removed: SimPlayer):
+        """Forget a player the simulation removed, and tell them."""
+        player = self.players.pop(removed.id, None)
+        self.ranking.remove(removed.id)
+        with self.seats_lock:
+            self.seats -= 1
+        if player is None:
+            return  # Never came back from a checkpoint.
+        player.player_model.score = removed.score
+        player.kill()
+
+    def update_ranking(self):
+        """Bring the ranking up to date with the simulation."""
+        for player in self.simulation.players.values():
+            self.ranking.set(player.id, player.name, player.score)
+
+    def stop(self):
+        """Stop thread."""
+        self.terminate_flag.set()
+        self.dump_profile()
+
+    def dump_profile(self):
+        """Log the tick profile, if profiling is enabled."""
+        if self.profiler.enabled:
+            report = self.profiler.report()
+            logger.info(f"Tick profile for {self.name}:\n{report}")
+            report = self.pipeline.profiler.report()
+            logger.info(f"Frame profile for {self.name}:\n{report}")
+
+    def game_model(self, ranking: bool) -> models.Game:
+        """Collate game data in to a data model.
+
+        The ranking of players is only included if asked for.
+        """
+        players = None
+        if ranking:
+            players = self.ranking.top(self.top_players)
+            for row in players:
+                row["rtt"] = self.rtt(row["id"])
+        return models.Game(
+            tick=self.tick,
+            players=players,
+            entities=self.simulation.entities(),
+        )
+
+    def rtt(self, id: int) -> Optional[int]:
+        """Get a player's round trip time in milliseconds, if measured."""
+        player = self.players.get(id)
+        if player is None or player.outbox.rtt is None:
+            return None
+        return round(player.outbox.rtt * 1000)
+
+    def lockstep_message(self, inputs: list[list], late: list[list]) -> dict:
+        """Make the event telling lockstep players about a tick.
+
+        Late inputs are sent too, for them to play the same ticks again.
+        """
+        data = {"tick": self.tick, "inputs": inputs}
+        if late:
+            data["late"] = late
+        if self.tick % HASH_INTERVAL == 0:
+            data["hash"] = self.simulation.hash()
+            data["rtt"] = [[id, self.rtt(id)] for id in self.players]
+        return {"event": {"type": "tick", "data": data}}
+
+    def send_sync(self, players: list[Player]):
+        """Send lockstep players the whole state, to simulate from."""
+        players = [
+            player
+            for player in players
+            if player.player_model.id in self.players
+        ]
+        if not players:
+            return
+        packed = msgpack.packb(
+            {
+                "event": {
+                    "type": "sync",
+                    "data": {
+                        "meta": self.info.dict(),
+                        "state": self.simulation.to_state(),
+                        "rewind": self.timeline.window,
+                    },
+                }
+            },
+            use_bin_type=True,
+        )
+        for player in players:
+            player.send_packed(packed)
+
+    def run(self):
+        """Run the game mainloop."""
+        self.pipeline.start()
+
+        next_tick = time.perf_counter()
+        while not self.terminate_flag.is_set():
+            # Calculations needed for maintaining stable FPS
+            next_tick += 1 / self.tickrate
+            sleep_time = next_tick - time.perf_counter()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+            elif sleep_time < -1 / self.tickrate:
+                next_tick = time.perf_counter()  # Too far behind to catch up.
+            if self.paused():
+                continue
+            tick_start = time.perf_counter()
+
+            profiler = self.profiler
+            profiler.start_tick()
+
+            inputs, late, syncs = self.collect_inputs()
+            profiler.lap(profiling.INPUT)
+
+            removed = []
+            if late:
+                removed += self.timeline.rewind(late)
+            profiler.lap(profiling.REWIND)
+            removed += self.timeline.step(inputs, profiler.lap)
+            for player in removed:
+                self.remove_player(player)
+            self.update_ranking()
+
+            # Send players game data
+            players = list(self.players.values())
+            state = None
+            if self.pipeline.ring is not None or not all(
+                player.lockstep for player in players
+            ):
+                # Only send the ranking when it changed, and now and then
+                # for players who joined since.
+                ranking = (
+                    self.ranking.version != self.sent_ranking
+                    or self.tick % compression.KEYFRAME_INTERVAL == 0
+                )
+                self.sent_ranking = self.ranking.version
+                state = self.game_model(ranking).dict(exclude_none=True)
+            message = None
+            if any(player.lockstep for player in players):
+                message = self.lockstep_message(inputs, late)
+            self.send_sync(syncs)
+            profiler.lap(profiling.MODEL)
+            # Sent while the next tick is simulated.
+            self.pipeline.submit(self.tick, state, players, message)
+            profiler.lap(profiling.HANDOFF)
+            profiler.end_tick()
+            self.adapt_tickrate(time.perf_counter() - tick_start)
+
+        self.pipeline.stop()
+        self.pipeline.join()
+
+    def adapt_tickrate(self, work: float):
+        """Track how loaded the game is, and change the tickrate to suit.
+
+        Only changes the tickrate if ADAPTIVE_TICKRATE is set.
+        """
+        self.load += (work * self.tickrate - self.load) / 8
+        now = time.monotonic()
+        if now - self.last_adapt < 1:
+            return
+        self.last_adapt = now
+        self.metrics.set(f"{self.name}.load", self.load)
+        self.metrics.set(f"{self.name}.tickrate", self.tickrate)
+        if not self.config.get("ADAPTIVE_TICKRATE", False):
+            return
+
+        target = self.config["TICKRATE"]
+        lowest = min(self.config.get("MIN_TICKRATE", 5), target)
+        if self.load > 0.9 and self.tickrate > lowest:
+            self.tickrate = max(lowest, self.tickrate * 0.8)
+            self.metrics.log(
+                "tickrate_lowered",
+                game=self.name,
+                tickrate=f"{self.tickrate:.1f}",
+                load=f"{self.load:.2f}",
+            )
+        elif self.load < 0.5 and self.tickrate < target:
+            self.tickrate = min(target, self.tickrate * 1.25)
+            self.metrics.log(
+                "tickrate_raised",
+                game=self.name,
+                tickrate=f"{self.tickrate:.1f}",
+                load=f"{self.load:.2f}",
+            )
+
+
+class Server(Thread):
+    """Game server process."""
+
+    def __init__(
+        self,
+        config: dict,
+        address: str = "tcp://:65444",
+        gateway: Optional[tuple[str, int]] = None,
+    ):
+        """Set up the game server.
+
+        The address can be any transport, see `common.transport`. If a
+        gateway address is given, the server registers with it so the
+        gateway can route players here, which needs a TCP address.
+        """
+        super().__init__()
+        self.terminate_flag = threading.Event()
+
+        self.address = address
+        # How often to check if we should stop.
+        self.listener = transport.listen(address, timeout=1)
+
+        self.game_config = config
+        self.clients = []
+        self.games = []
+        self.games_lock = threading.Lock()
+        # Where players are sent once the games are being drained.
+        self.drain_address: Optional[str] = None
+        self.next_player_id = 1
+        self.metrics = Metrics()
+        self.admission = admission.Admission(config, self.metrics)
+        self.leaderboard = Leaderboard(
+            config.get("LEADERBOARD_PATH", "leaderboard.sqlite3")
+        )
+
+        self.gateway_link = None
+        if gateway is not None:
+            _, port = transport.host_port(address)
+            self.gateway_link = GatewayLink(
+                gateway,
+                (config.get("PUBLIC_HOST", ""), port),
+                self.live_clients,
+                config.get("GATEWAY_TOKEN", ""),
+            )
+
+    def live_clients(self) -> int:
+        """Count the clients that haven't stopped."""
+        return sum(
+            not client.terminate_flag.is_set() for client in self.clients
+        )
+
+    def on_connect(self, conn: transport.Connection, peer: str):
+        """Handle a new connection to the server."""
+        if self.live_clients() >= self.admission.max_connections:
+            self.turn_away(conn, peer)
+            return
+        logger.info(f"New client connected: {peer}.")
+        client = Player(
+            conn,
+            peer,
+            models.Player(id=self.next_player_id, name=UNNAMED, score=0),
+            self.metrics,
+            self.game_config,
+        )
+        client.server = self
+        self.next_player_id += 1
+        self.clients.append(client)
+        client.start()
+
+    def turn_away(self, conn: transport.Connection, peer: str):
+        """Tell a connection the server is busy and close it.
+
+        This is done before making any threads for it, so a flood of
+        connections costs little.
+        """
+        event = self.admission.refuse(admission.CONNECTIONS)
+        try:
+            conn.settimeout(1)
+            conn.sendall(msgpack.packb(event, use_bin_type=True))
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # They're gone already.
+        conn.close()
+
+    def remove_client(self, client: Player):
+        """Forget a client that has left."""
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def join_game(self, client: Player):
+        """Put a client that has said hello into a game, if there's room.
+
+        Otherwise they wait in line, or are turned away if it's full. While
+        draining, they are sent to the next server instead.
+        """
+        with self.games_lock:
+            if self.drain_address is not None:
+                self.send_on(client, self.drain_address)
+                return
+            line = self.admission
+            reason = admission.LINE
+            if not line.waiting:
+                reason = line.busy(self.games, self.clients)
+                if reason is None:
+                    self.place(client)
+                    return
+            position = line.enqueue(client)
+        if position is None:
+            client.send(line.refuse(reason))
+            client.leave()
+        else:
+            client.send(admission.busy_event(reason, position))
+
+    def admit_waiting(self):
+        """Let players in line into games while there's room."""
+        with self.games_lock:
+            line = self.admission
+            line.prune()
+            admitted = False
+            while line.waiting:
+                reason = line.busy(self.games, self.clients)
+                if reason is not None:
+                    break
+                self.place(line.next())
+                admitted = True
+            if admitted:
+                # Everyone else moved up.
+                for position, client in enumerate(line.waiting, 1):
+                    client.send(admission.busy_event(reason, position))
+
+    def place(self, client: Player):
+        """Put a client in a game with room, or a new one."""
+        for game in self.games:
+            if not game.full:
+                game.add_player(client)
+                return
+        # No game was found.
+        new_game = Game(self.game_config, self.metrics)
+        self.games.append(new_game)
+        new_game.add_player(client)
+        new_game.start()
+
+    def send_on(
+        self, client: Player, address: str, token: Optional[str] = None
+    ):
+        """Tell a client to reconnect to another server, and let them go."""
+        client.send(checkpoint.migrate_event(address, token))
+        client.stop()
+
+    def resume(self, client: Player, token: str) -> bool:
+        """Put a client back in the restored game their token is from.
+
+        While draining, they are sent on with their token, in case the next
+        server has their game.
+        """
+        with self.games_lock:
+            if self.drain_address is not None:
+                self.send_on(client, self.drain_address, token)
+                return True
+            return any(game.resume(client, token) for game in self.games)
+
+    def restore(self, path: str):
+        """Carry on the games in a checkpoint file, before starting."""
+        start = time.perf_counter()
+        saved = checkpoint.load(path)
+        for game_state in saved:
+            game = Game(self.game_config, self.metrics, game_state)
+            # New players mustn't get a restored player's id.
+            last_id = max(game.simulation.players, default=0)
+            self.next_player_id = max(self.next_player_id, last_id + 1)
+            self.games.append(game)
+            game.start()
+        self.metrics.log(
+            "checkpoint_restored",
+            games=len(saved),
+            ms=f"{(time.perf_counter() - start) * 1000:.1f}",
+        )
+
+    def drain(self, address: str, path: str):
+        """Move every game to the server at an address.
+
+        The games are stopped and saved to a checkpoint file for that server
+        to restore, and their players are told to reconnect there.
+        """
+        with self.games_lock:
+            # Players saying hello from now on are sent on too.
+            self.drain_address = address
+            games, self.games = self.games, []
+            waiting = list(self.admission.waiting)
+            self.admission.waiting.clear()
+        for game in games:
+            game.terminate_flag.set()
+            game.join()
+        start = time.perf_counter()
+        size = checkpoint.save(path, [game.checkpoint() for game in games])
+        self.metrics.log(
+            "checkpoint_saved",
+            games=len(games),
+            bytes=size,
+            ms=f"{(time.perf_counter() - start) * 1000:.1f}",
+        )
+        for game in games:
+            game.migrate(address)
+        # Those in line can join a game on the other server instead.
+        for client in waiting:
+            self.send_on(client, address)
+
+    def dump_profiles(self):
+        """Log the tick profile of every game."""
+        with self.games_lock:
+            games = list(self.games)
+        for game in games:
+            game.dump_profile()
+
+    def stop(self):
+        """Stop the server."""
+        self.terminate_flag.set()
+
+    def run(self):
+        """Run the server and wait for connections."""
+        logger.info(f"Server listing on {self.address}.")
+        self.leaderboard.start()
+        if self.gateway_link is not None:
+            self.gateway_link.start()
+        while not self.terminate_flag.is_set():
+            try:
+                conn, peer = self.listener.accept()
+                self.on_connect(conn, peer)
+            except (BrokenPipeError, IOError, socket.timeout):
+                pass  # meaningless errors, prevent crash
+            self.admit_waiting()
+
+        # Stop everything.
+        self.listener.close()
+        if self.gateway_link is not None:
+            self.gateway_link.stop()
+        for thread in (*self.clients, *self.games, self.leaderboard):
+            thread.stop()
+            thread.join()
@@ -0,0 +1,289 @@
+"""Gateway routing players to game servers.
+
+Game servers register with the gateway and report their load. Players connect
+to the gateway's one well known address and are sent on to the least loaded
+game server, either by proxying their stream or by telling them to reconnect
+to the game server directly.
+
+Run a gateway with `python -m server.gateway`, and point game servers at it
+with the `gateway` argument of `Server`.
+"""
+import argparse
+import logging
+import socket
+import threading
+import time
+from threading import Thread
+from typing import Callable, Optional
+
+import msgpack
+
+from common.receiver import MAX_CLIENT_MESSAGE, Receiver
+
+logger = logging.getLogger("snake.gateway")
+
+PROXY = "proxy"
+REDIRECT = "redirect"
+
+# How often game servers report their load, in seconds.
+REPORT_INTERVAL = 1
+# How long a new connection has to send its first message, in seconds.
+FIRST_MESSAGE_TIMEOUT = 10
+# Bytes copied at a time when proxying.
+PIPE_BUFFER = 65536
+
+
+def read_first_message(conn: socket.socket) -> tuple[Optional[dict], bytes]:
+    """Read the first message on a connection.
+
+    Returns the message and every byte read, so it can be passed on as is.
+    """
+    receiver = Receiver(conn, MAX_CLIENT_MESSAGE)
+    received = bytearray()
+    while True:
+        messages = receiver.receive()
+        received += receiver.data
+        if messages is None:
+            return None, bytes(received)
+        if messages:
+            return messages[0], bytes(received)
+
+
+class Backend:
+    """A game server registered with the gateway."""
+
+    def __init__(self, host: str, port: int):
+        """Set up the backend."""
+        self.host = host
+        self.port = port
+        self.players = 0
+        # Players sent here since the backend last reported its load.
+        self.pending = 0
+
+    @property
+    def load(self) -> int:
+        """Get the number of players on the backend, counting pending ones."""
+        return self.players + self.pending
+
+
+class Gateway(Thread):
+    """Accepts players on one address and routes them to game servers."""
+
+    def __init__(
+        self,
+        host: str = "",
+        port: int = 65444,
+        mode: str = PROXY,
+        token: str = "",
+    ):
+        """Set up the gateway."""
+        super().__init__()
+        self.terminate_flag = threading.Event()
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.token = token  # Game servers must know this to register.
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.settimeout(10)
+        self.socket.listen()
+
+        self.backends = []
+        self.backends_lock = threading.Lock()
+
+    def least_loaded(self) -> Optional[Backend]:
+        """Pick the backend for a new player, counting them as pending."""
+        with self.backends_lock:
+            if not self.backends:
+                return None
+            backend = min(self.backends, key=lambda backend: backend.load)
+            backend.pending += 1
+            return backend
+
+    def on_connect(self, conn: socket.socket, addr: tuple[str, int]):
+        """Handle a new connection, from either a player or a game server."""
+        try:
+            conn.settimeout(FIRST_MESSAGE_TIMEOUT)
+            message, received = read_first_message(conn)
+            event = (message or {}).get("event", {})
+            if event.get("type") == "register":
+                self.serve_backend(conn, addr, event["data"])
+            elif message is not None:
+                self.route_player(conn, received)
+            else:
+                conn.close()
+        except (OSError, KeyError, ValueError):
+            conn.close()
+
+    def serve_backend(
+        self, conn: socket.socket, addr: tuple[str, int], data: dict
+    ):
+        """Keep track of a game server's load until it disconnects."""
+        if data.get("token", "") != self.token:
+            logger.warning(f"Bad token from game server at {addr[0]}.")
+            conn.close()
+            return
+        backend = Backend(data.get("host") or addr[0], data["port"])
+        with self.backends_lock:
+            self.backends.append(backend)
+        logger.info(f"Game server registered: {backend.host}:{backend.port}.")
+
+        conn.settimeout(REPORT_INTERVAL * 5)
+        receiver = Receiver(conn, MAX_CLIENT_MESSAGE)
+        try:
+            while not self.terminate_flag.is_set():
+                messages = receiver.receive()
+                if messages is None:
+                    break
+                for message in messages:
+                    event = message["event"]
+                    if event["type"] == "load":
+                        with self.backends_lock:
+                            backend.players = event["data"]["players"]
+                            backend.pending = 0
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+        finally:
+            with self.backends_lock:
+                self.backends.remove(backend)
+            conn.close()
+            logger.info(f"Game server left: {backend.host}:{backend.port}.")
+
+    def route_player(self, conn: socket.socket, received: bytes):
+        """Send a player on to the least loaded game server."""
+        backend = self.least_loaded()
+        if backend is None:
+            logger.warning("No game servers to route a player to.")
+            conn.close()
+            return
+
+        if self.mode == REDIRECT:
+            event = {"host": backend.host, "port": backend.port}
+            conn.sendall(
+                msgpack.packb(
+                    {"event": {"type": "redirect", "data": event}},
+                    use_bin_type=True,
+                )
+            )
+            conn.close()
+            return
+
+        upstream = socket.create_connection((backend.host, backend.port))
+        upstream.sendall(received)
+        conn.settimeout(None)
+        Thread(target=pipe, args=(upstream, conn), daemon=True).start()
+        pipe(conn, upstream)
+
+    def stop(self):
+        """Stop the gateway."""
+        self.terminate_flag.set()
+
+    def run(self):
+        """Wait for connections."""
+        logger.info(f"Gateway listening on {self.host}:{self.port}.")
+        while not self.terminate_flag.is_set():
+            try:
+                conn, addr = self.socket.accept()
+                Thread(
+                    target=self.on_connect, args=(conn, addr), daemon=True
+                ).start()
+            except (BrokenPipeError, IOError, socket.timeout):
+                pass  # meaningless errors, prevent crash
+        self.socket.close()
+
+
+def pipe(source: socket.socket, destination: socket.socket):
+    """Copy bytes from one socket to another until either closes."""
+    buffer = memoryview(bytearray(PIPE_BUFFER))
+    try:
+        while True:
+            size = source.recv_into(buffer)
+            if not size:
+                break
+            destination.sendall(buffer[:size])
+    except OSError:
+        pass
+    finally:
+        for sock in (source, destination):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class GatewayLink(Thread):
+    """Registers a game server with a gateway and reports its load."""
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        public_address: tuple[str, int],
+        load: Callable[[], int],
+        token: str = "",
+    ):
+        """Set up the link.
+
+        `public_address` is where players should reach the game server; an
+        empty host means the address the gateway sees it connect from.
+        `load` gives the number of players on the game server.
+        """
+        super().__init__(daemon=True)
+        self.terminate_flag = threading.Event()
+        self.address = address
+        self.public_address = public_address
+        self.load = load
+        self.token = token
+
+    def send(self, sock: socket.socket, type: str, data: dict):
+        """Send an event to the gateway."""
+        sock.sendall(
+            msgpack.packb(
+                {"event": {"type": type, "data": data}}, use_bin_type=True
+            )
+        )
+
+    def stop(self):
+        """Stop reporting."""
+        self.terminate_flag.set()
+
+    def run(self):
+        """Register and report load, reconnecting if the gateway goes away."""
+        while not self.terminate_flag.is_set():
+            try:
+                with socket.create_connection(self.address) as sock:
+                    self.send(
+                        sock,
+                        "register",
+                        {
+                            "host": self.public_address[0],
+                            "port": self.public_address[1],
+                            "token": self.token,
+                        },
+                    )
+                    while not self.terminate_flag.is_set():
+                        self.send(sock, "load", {"players": self.load()})
+                        self.terminate_flag.wait(REPORT_INTERVAL)
+            except OSError:
+                logger.warning(f"Lost gateway {self.address}, retrying.")
+                self.terminate_flag.wait(REPORT_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="")
+    parser.add_argument("--port", type=int, default=65444)
+    parser.add_argument("--mode", choices=(PROXY, REDIRECT), default=PROXY)
+    parser.add_argument("--token", default="")
+    args = parser.parse_args()
+    gateway = Gateway(args.host, args.port, args.mode, args.token)
+    gateway.start()
+    try:
+        while gateway.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        gateway.stop()
+        gateway.join()
@@ -0,0 +1,158 @@
+"""Leaderboard of each player's best score, kept across matches.
+
+Scores are stored in SQLite in WAL mode. Writes are queued and committed in
+batches by the leaderboard's own thread, so recording a score never blocks a
+game. Ranks come from an in-memory Fenwick tree over scores, so finding a
+player's rank takes logarithmic time.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+from threading import Thread
+from typing import Optional
+
+logger = logging.getLogger("snake.leaderboard")
+
+BATCH_SIZE = 500
+# How long to wait for more scores before committing a batch, in seconds.
+FLUSH_INTERVAL = 0.5
+TOP_COUNT = 10
+# Name of players who never picked one. Their scores aren't kept.
+UNNAMED = "Unamed Player"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    name TEXT PRIMARY KEY,
+    best INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scores_best ON scores (best DESC);
+"""
+
+UPSERT = """
+INSERT INTO scores (name, best) VALUES (?, ?)
+ON CONFLICT (name) DO UPDATE SET best = excluded.best
+WHERE excluded.best > scores.best
+"""
+
+
+class ScoreIndex:
+    """Fenwick tree counting how many players have each best score."""
+
+    def __init__(self):
+        """Set up an empty index."""
+        self.tree = [0] * 64
+
+    def add(self, score: int, amount: int):
+        """Add to the number of players with a score."""
+        while score + 1 >= len(self.tree):
+            self._grow()
+        index = score + 1
+        while index < len(self.tree):
+            self.tree[index] += amount
+            index += index & -index
+
+    def _grow(self):
+        """Double the range of scores the tree can hold."""
+        size = len(self.tree)
+        self.tree.extend([0] * size)
+        # The new upper node covers the whole old range.
+        total = 0
+        index = size - 1
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        self.tree[size] = total
+
+    def count_up_to(self, score: int) -> int:
+        """Count the players with a best score up to and including score."""
+        index = min(score + 1, len(self.tree) - 1)
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class Leaderboard(Thread):
+    """Persistent leaderboard fed from a queue of scores."""
+
+    def __init__(self, path: str):
+        """Open the leaderboard database."""
+        super().__init__(daemon=True)
+        self.terminate_flag = threading.Event()
+        self.path = path
+        self.scores = queue.SimpleQueue()
+
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.reader.execute("PRAGMA journal_mode=WAL")
+        self.reader.executescript(SCHEMA)
+        self.reader_lock = threading.Lock()
+
+        # In-memory copy of the best scores, for ranks.
+        self.best = dict(self.reader.execute("SELECT name, best FROM scores"))
+        self.index = ScoreIndex()
+        for score in self.best.values():
+            self.index.add(score, 1)
+        self.best_lock = threading.Lock()
+
+    def record(self, name: str, score: int):
+        """Queue a score to be saved. This never blocks.
+
+        Scores of 0 and of players without a name are left out.
+        """
+        if score > 0 and name != UNNAMED:
+            self.scores.put((name, score))
+
+    def top(self, count: int = TOP_COUNT) -> list[tuple[str, int]]:
+        """Get the best players and their scores, best first."""
+        with self.reader_lock:
+            return self.reader.execute(
+                "SELECT name, best FROM scores ORDER BY best DESC LIMIT ?",
+                (count,),
+            ).fetchall()
+
+    def rank(self, name: str) -> Optional[int]:
+        """Get a player's rank, starting at 1, if they have a score."""
+        with self.best_lock:
+            best = self.best.get(name)
+            if best is None:
+                return None
+            return len(self.best) - self.index.count_up_to(best) + 1
+
+    def _update_best(self, batch: list[tuple[str, int]]):
+        """Apply a batch of scores to the in-memory best scores."""
+        with self.best_lock:
+            for name, score in batch:
+                old = self.best.get(name)
+                if old is not None and old >= score:
+                    continue
+                if old is not None:
+                    self.index.add(old, -1)
+                self.index.add(score, 1)
+                self.best[name] = score
+
+    def stop(self):
+        """Stop the thread once the queued scores are saved."""
+        self.terminate_flag.set()
+
+    def run(self):
+        """Save queued scores in batches."""
+        writer = sqlite3.connect(self.path)
+        writer.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            batch = []
+            try:
+                batch.append(self.scores.get(timeout=FLUSH_INTERVAL))
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.scores.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                with writer:
+                    writer.executemany(UPSERT, batch)
+                self._update_best(batch)
+            elif self.terminate_flag.is_set():
+                break
+        writer.close()
+        self.reader.close()
@@ -0,0 +1,44 @@
+"""Counters and gauges describing how the server is doing.
+
+Changes worth noting, like a client's update rate being lowered, are also
+logged as they happen on the `snake.metrics` logger, as a name followed by
+key=value fields.
+"""
+import logging
+import threading
+
+logger = logging.getLogger("snake.metrics")
+
+
+class Metrics:
+    """A set of named counters and gauges."""
+
+    def __init__(self):
+        """Set up empty metrics."""
+        self.values: dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name: str, amount: float = 1):
+        """Add to a counter."""
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def set(self, name: str, value: float):
+        """Set a gauge."""
+        self.values[name] = value
+
+    def remove(self, name: str):
+        """Remove a gauge that no longer applies."""
+        with self.lock:
+            self.values.pop(name, None)
+
+    def log(self, name: str, **fields: object):
+        """Count an event and log it with its fields."""
+        self.incr(name)
+        details = " ".join(f"{key}={value}" for key, value in fields.items())
+        logger.info(f"{name} {details}")
+
+    def snapshot(self) -> dict[str, float]:
+        """Get a copy of every metric."""
+        with self.lock:
+            return dict(self.values)
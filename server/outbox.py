@@ -0,0 +1,208 @@
+"""Sending to one client without holding up its game.
+
+Every player has an `Outbox` thread that does all the writing to its socket.
+Events are queued and always sent, but frames go in a single slot, so a
+client that can't keep up gets the newest frame rather than a backlog. The
+outbox pings the client to measure its round trip time, times how fast its
+frames drain, and has the game send frames on only every `stride`th tick
+while the client is falling behind. Events can't be skipped like that, so
+a client with MAX_EVENTS of them waiting is cut off instead.
+"""
+import socket
+import threading
+import time
+from collections import deque
+from threading import Thread
+from typing import Optional
+
+import msgpack
+
+from common import transport
+
+from .metrics import Metrics
+
+PING_INTERVAL = 1.0
+# Weight of each new sample in the smoothed RTT and drain rate.
+SMOOTHING = 1 / 8
+# Clients with a smoothed RTT above this are sent fewer frames.
+SLOW_RTT = 0.25
+MAX_STRIDE = 8
+# Seconds between changes to the stride.
+ADJUST_INTERVAL = 1.0
+# Seconds without trouble before the stride is lowered again.
+RECOVER_INTERVAL = 3.0
+# Events waiting to be sent before the client is cut off, like a lockstep
+# client that stopped reading its inputs.
+MAX_EVENTS = 1000
+
+
+def smooth(average: Optional[float], sample: float) -> float:
+    """Add a sample to an exponentially weighted moving average."""
+    if average is None:
+        return sample
+    return average + SMOOTHING * (sample - average)
+
+
+class Outbox(Thread):
+    """Writes events and frames to a client."""
+
+    def __init__(
+        self, conn: transport.Connection, metrics: Metrics, name: str
+    ):
+        """Set up the outbox for a connection."""
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.metrics = metrics
+        self.client = name  # For metrics.
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closing = threading.Event()
+        self.events = deque()
+        self.frame = None
+        self.overflowed = False
+
+        self.stride = 1  # Send a frame every this many ticks.
+        self.rtt: Optional[float] = None  # Smoothed, in seconds.
+        self.drain_rate: Optional[float] = None  # Bytes per second.
+        self.dropped = 0  # Frames replaced before being sent.
+        self.last_ping = 0.0
+        self.last_adjust = self.last_trouble = time.monotonic()
+
+    @property
+    def backlog(self) -> int:
+        """Get the number of messages waiting to be sent."""
+        return len(self.events) + (self.frame is not None)
+
+    def put(self, packed: bytes) -> bool:
+        """Queue a packed event.
+
+        Returns False once MAX_EVENTS are waiting. The queued events are then
+        dropped and the connection shut down, as the client can't catch up.
+        """
+        with self.lock:
+            if self.overflowed:
+                return False
+            if len(self.events) < MAX_EVENTS:
+                self.events.append(packed)
+                self.wakeup.set()
+                return True
+            self.overflowed = True
+            self.events.clear()
+            self.closing.set()
+            self.wakeup.set()
+        self.metrics.log("client_overflow", client=self.client)
+        try:
+            # Stops a send stuck on the client.
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return False
+
+    def offer_frame(self, frame: bytes) -> bool:
+        """Make a frame the next one to send.
+
+        Returns False if it replaced a frame that wasn't sent yet. This is
+        also where the stride is adjusted, as the outbox thread may be stuck
+        sending to a slow client.
+        """
+        with self.lock:
+            replaced = self.frame is not None
+            self.frame = frame
+            if replaced:
+                self.dropped += 1
+            self.wakeup.set()
+        now = time.monotonic()
+        if now - self.last_adjust >= ADJUST_INTERVAL:
+            self.adjust(now)
+        return not replaced
+
+    def on_pong(self, sent: float):
+        """Take an RTT sample from the answer to a ping."""
+        if not isinstance(sent, float):
+            return
+        self.rtt = smooth(self.rtt, time.monotonic() - sent)
+        self.metrics.set(f"{self.client}.rtt_ms", round(self.rtt * 1000))
+
+    def close(self):
+        """Stop once the queued events are sent."""
+        self.closing.set()
+        self.wakeup.set()
+
+    def adjust(self, now: float):
+        """Change the stride if the client is falling behind or recovered."""
+        with self.lock:
+            dropped = self.dropped
+            self.dropped = 0
+        self.last_adjust = now
+        slow = self.rtt is not None and self.rtt > SLOW_RTT
+        if dropped or slow:
+            self.last_trouble = now
+            if self.stride < MAX_STRIDE:
+                self.stride *= 2
+                self.log("client_rate_lowered", dropped=dropped)
+        elif self.stride > 1 and now - self.last_trouble >= RECOVER_INTERVAL:
+            self.last_trouble = now
+            self.stride //= 2
+            self.log("client_rate_raised")
+
+    def log(self, name: str, **fields: object):
+        """Log a change to the client's rate as a metric."""
+        rtt = "-" if self.rtt is None else f"{self.rtt * 1000:.0f}"
+        drain = "-" if self.drain_rate is None else f"{self.drain_rate:.0f}"
+        self.metrics.log(
+            name,
+            client=self.client,
+            stride=self.stride,
+            rtt_ms=rtt,
+            drain_bps=drain,
+            **fields,
+        )
+
+    def ping(self, now: float) -> bytes:
+        """Make a ping, telling the client the RTT measured so far."""
+        rtt = None if self.rtt is None else round(self.rtt * 1000)
+        return msgpack.packb(
+            {"event": {"type": "ping", "data": {"time": now, "rtt": rtt}}}
+        )
+
+    def run(self):
+        """Write to the client until closed."""
+        try:
+            while True:
+                self.wakeup.wait(PING_INTERVAL)
+                # Checked first, so every event queued before closing is sent.
+                closing = self.closing.is_set()
+                with self.lock:
+                    events = list(self.events)
+                    self.events.clear()
+                    frame = self.frame
+                    self.frame = None
+                    self.wakeup.clear()
+
+                for packed in events:
+                    self.conn.sendall(packed)
+                if closing:
+                    break
+                if frame is not None:
+                    start = time.monotonic()
+                    self.conn.sendall(frame)
+                    elapsed = time.monotonic() - start
+                    if elapsed > 0:
+                        self.drain_rate = smooth(
+                            self.drain_rate, len(frame) / elapsed
+                        )
+
+                now = time.monotonic()
+                if now - self.last_ping >= PING_INTERVAL:
+                    self.last_ping = now
+                    self.conn.sendall(self.ping(now))
+        except OSError:
+            pass
+        finally:
+            self.metrics.remove(f"{self.client}.rtt_ms")
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.conn.close()
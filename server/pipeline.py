@@ -0,0 +1,165 @@
+"""Serializing and sending a game's frames on their own thread.
+
+The game hands over a snapshot of each tick's state, and the inputs for
+lockstep players, then goes on to simulate the next tick while they are
+packed, compressed and sent. Only one snapshot waits while another is being
+sent, so the game blocks rather than running ahead of a pipeline that can't
+keep up, and every encoder sees every tick in order.
+
+Given a `FrameRingWriter`, the pipeline also writes every packed frame to
+it, for processes on the same machine to read. Frames too big for a slot
+are counted in the "frame_ring.too_big" metric and left out.
+"""
+import logging
+import queue
+from threading import Thread
+from typing import TYPE_CHECKING, Any, Optional
+
+import msgpack
+
+from common import compression
+from common.framering import FrameRingWriter
+
+from . import profiling
+from .metrics import Metrics
+
+if TYPE_CHECKING:
+    from .core import Player
+
+logger = logging.getLogger("snake.server.pipeline")
+
+
+class FramePipeline(Thread):
+    """Packs, compresses and sends a game's frames."""
+
+    def __init__(
+        self,
+        name: str,
+        metrics: Metrics,
+        profile: bool = False,
+        ring: Optional[FrameRingWriter] = None,
+    ):
+        """Set up the pipeline for a game."""
+        super().__init__(name=name, daemon=True)
+        self.metrics = metrics
+        self.ring = ring
+        self.too_big = 0  # Frames left out of the ring.
+        # The snapshot waiting to be sent, while another is being sent.
+        self.snapshots = queue.Queue(maxsize=1)
+        self.encoders = {}  # One per compression mode in use.
+        if profile:
+            self.profiler = profiling.TickProfiler(profiling.FRAME_PHASES)
+        else:
+            self.profiler = profiling.NullProfiler()
+
+    def submit(
+        self,
+        tick: int,
+        state: Optional[dict[str, Any]],
+        players: list["Player"],
+        message: Optional[dict] = None,
+    ):
+        """Queue a tick's state to be sent to players.
+
+        Lockstep players are sent the message instead. Blocks while the
+        previous snapshot is still waiting.
+        """
+        self.snapshots.put((tick, state, players, message))
+
+    def stop(self):
+        """Stop once the queued snapshots are sent."""
+        self.snapshots.put(None)
+
+    def publish(self, tick: int, packed: bytes):
+        """Write a frame to the ring, counting those too big for it."""
+        if self.ring.publish(tick, packed):
+            return
+        if not self.too_big:
+            logger.warning(
+                f"Frame of {len(packed)} bytes is too big for the ring "
+                f"{self.ring.path}, raise FRAME_RING_SLOT_SIZE."
+            )
+        self.too_big += 1
+        self.metrics.incr("frame_ring.too_big")
+
+    def encode(self, mode: str, packed: bytes) -> tuple[bytes, bool]:
+        """Compress a frame with the pipeline's encoder for a mode."""
+        if mode not in self.encoders:
+            self.encoders[mode] = compression.encoder(mode)
+        return self.encoders[mode].encode(packed)
+
+    def run(self):
+        """Send snapshots until stopped."""
+        while True:
+            snapshot = self.snapshots.get()
+            if snapshot is None:
+                break
+            tick, state, players, message = snapshot
+
+            profiler = self.profiler
+            profiler.start_tick()
+            frames = {}
+            # Frames compressed on their own, made once per mode if needed.
+            standalone = {}
+            if state is not None:
+                packed = msgpack.packb(state, use_bin_type=True)
+                if self.ring is not None:
+                    self.publish(tick, packed)
+                for player in players:
+                    if player.lockstep:
+                        continue  # Sent inputs instead.
+                    if player.compression not in frames:
+                        frames[player.compression] = self.encode(
+                            player.compression, packed
+                        )
+            if message is not None:
+                message = msgpack.packb(message, use_bin_type=True)
+            profiler.lap(profiling.SERIALIZE)
+            for player in players:
+                if player.lockstep:
+                    player.send_packed(message)
+                else:
+                    self.send_frame(tick, player, packed, frames, standalone)
+            profiler.lap(profiling.SEND)
+            profiler.end_tick()
+        if self.ring is not None:
+            self.ring.close()
+
+    def send_frame(
+        self,
+        tick: int,
+        player: "Player",
+        packed: bytes,
+        frames: dict[str, tuple],
+        standalone: dict[str, bytes],
+    ):
+        """Offer a tick's frame to a player, if they are due one.
+
+        Players who are behind get frames less often. Players who missed
+        part of a stream get frames that don't need the stream until its
+        next keyframe. Those are compressed once per tick for each mode,
+        however many players need them.
+        """
+        if tick % player.outbox.stride:
+            player.synced = False  # Skipping breaks the stream.
+            return
+        mode = player.compression
+        encoder = self.encoders[mode]
+        frame, keyframe = frames[mode]
+        player.synced = player.synced or keyframe
+        if not player.synced:
+            frame = self.encode_standalone(mode, packed, standalone)
+        if not player.outbox.offer_frame(frame) and encoder.streaming:
+            # The frame it replaced was part of the stream.
+            player.synced = False
+            player.outbox.offer_frame(
+                self.encode_standalone(mode, packed, standalone)
+            )
+
+    def encode_standalone(
+        self, mode: str, packed: bytes, standalone: dict[str, bytes]
+    ) -> bytes:
+        """Compress a tick's frame on its own, once per mode."""
+        if mode not in standalone:
+            standalone[mode] = self.encoders[mode].encode_standalone(packed)
+        return standalone[mode]
@@ -0,0 +1,164 @@
+"""Opt-in profiling of the phases of a game tick.
+
+Each phase is timed with `time.perf_counter` and recorded in a histogram
+with power-of-two microsecond buckets, so recording is a couple of integer
+operations and memory use is fixed no matter how long a game runs.
+"""
+import time
+
+# Phases of a tick, in the order they run.
+INPUT = "input"
+REWIND = "rewind"  # Playing ticks again for late inputs.
+HISTORY = "history"  # Saving the state, so the tick can be played again.
+MOVE = "move"
+COLLIDE = "collide"
+COLLIDE_PLAYERS = "collide_players"
+APPLES = "apples"
+MODEL = "model"
+HANDOFF = "handoff"  # Waiting for the frame pipeline to take a snapshot.
+SERIALIZE = "serialize"
+SEND = "send"
+TICK = "tick"  # The whole tick, excluding the sleep.
+
+PHASES = (
+    INPUT,
+    REWIND,
+    HISTORY,
+    MOVE,
+    COLLIDE,
+    COLLIDE_PLAYERS,
+    APPLES,
+    MODEL,
+    HANDOFF,
+    SERIALIZE,
+    SEND,
+    TICK,
+)
+# Phases timed by a game, and by its frame pipeline.
+GAME_PHASES = PHASES[:9] + (TICK,)
+FRAME_PHASES = (SERIALIZE, SEND, TICK)
+
+# Bucket i holds durations in [2 ** (i - 1), 2 ** i) microseconds.
+BUCKETS = 32
+
+
+class Histogram:
+    """Latency histogram with power-of-two microsecond buckets."""
+
+    def __init__(self):
+        """Set up an empty histogram."""
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """Record one duration."""
+        micros = int(seconds * 1_000_000)
+        self.buckets[min(micros.bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Get the upper bound of the bucket holding a percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for index, amount in enumerate(self.buckets):
+            seen += amount
+            if seen >= wanted:
+                return min((1 << index) / 1_000_000, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Summarise the histogram, with times in milliseconds."""
+        mean = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "mean": mean * 1000,
+            "p50": self.percentile(0.5) * 1000,
+            "p99": self.percentile(0.99) * 1000,
+            "max": self.max * 1000,
+            "buckets": list(self.buckets),
+        }
+
+
+class NullProfiler:
+    """Profiler that records nothing, used when profiling is disabled."""
+
+    enabled = False
+
+    def start_tick(self):
+        """Start timing a tick."""
+
+    def lap(self, phase: str):
+        """Charge the time since the last lap to a phase."""
+
+    def end_tick(self):
+        """Finish timing a tick."""
+
+    def snapshot(self) -> dict:
+        """Get the recorded histograms."""
+        return {}
+
+    def report(self) -> str:
+        """Format the recorded histograms for logging."""
+        return "profiling disabled"
+
+
+class TickProfiler(NullProfiler):
+    """Times each phase of a tick and keeps a histogram per phase.
+
+    Phases may be entered several times per tick (once per player, say);
+    their laps are summed so each histogram sample is the phase's total
+    for one tick.
+    """
+
+    enabled = True
+
+    def __init__(self, phases: tuple[str, ...] = PHASES):
+        """Set up empty histograms for some phases."""
+        self.histograms = {phase: Histogram() for phase in phases}
+        self._current = dict.fromkeys(phases, 0.0)
+        self._tick_start = self._last = time.perf_counter()
+
+    def start_tick(self):
+        """Start timing a tick."""
+        self._tick_start = self._last = time.perf_counter()
+
+    def lap(self, phase: str):
+        """Charge the time since the last lap to a phase."""
+        now = time.perf_counter()
+        self._current[phase] += now - self._last
+        self._last = now
+
+    def end_tick(self):
+        """Finish timing a tick and record it in the histograms."""
+        self._current[TICK] = time.perf_counter() - self._tick_start
+        for phase, seconds in self._current.items():
+            self.histograms[phase].record(seconds)
+            self._current[phase] = 0.0
+
+    def snapshot(self) -> dict:
+        """Get a summary of every phase's histogram."""
+        return {
+            phase: histogram.summary()
+            for phase, histogram in self.histograms.items()
+        }
+
+    def report(self) -> str:
+        """Format the histograms as a table for logging."""
+        lines = [
+            f"{'phase':<16}{'count':>8}{'mean ms':>10}"
+            f"{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        ]
+        for phase, stats in self.snapshot().items():
+            lines.append(
+                f"{phase:<16}{stats['count']:>8}{stats['mean']:>10.3f}"
+                f"{stats['p50']:>10.3f}{stats['p99']:>10.3f}"
+                f"{stats['max']:>10.3f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,48 @@
+"""Ranking of the players in a game, kept up to date as scores change."""
+import bisect
+
+
+class Ranking:
+    """Players ordered by score, best first.
+
+    The order is a sorted list of (-score, id) keys, so a score change moves
+    a single key. `version` goes up on every change, so callers can tell
+    when to resend the ranking.
+    """
+
+    def __init__(self):
+        """Set up an empty ranking."""
+        self.keys: list[tuple[int, int]] = []
+        self.players: dict[int, list] = {}  # id -> [id, name, score]
+        self.version = 0
+
+    def set(self, id: int, name: str, score: int):
+        """Add a player, or update their name and score."""
+        row = self.players.get(id)
+        if row is not None:
+            if row[1] == name and row[2] == score:
+                return
+            if row[2] != score:
+                del self.keys[bisect.bisect_left(self.keys, (-row[2], id))]
+                bisect.insort(self.keys, (-score, id))
+            row[1] = name
+            row[2] = score
+        else:
+            self.players[id] = [id, name, score]
+            bisect.insort(self.keys, (-score, id))
+        self.version += 1
+
+    def remove(self, id: int):
+        """Remove a player."""
+        row = self.players.pop(id, None)
+        if row is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-row[2], id))]
+            self.version += 1
+
+    def top(self, count: int) -> list[dict]:
+        """Get the best players, in the form of `models.Player`."""
+        rows = []
+        for _, id in self.keys[:count]:
+            _, name, score = self.players[id]
+            rows.append({"id": id, "name": name, "score": score})
+        return rows
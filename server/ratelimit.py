@@ -0,0 +1,24 @@
+"""Limiting how fast clients can send events."""
+import time
+
+
+class TokenBucket:
+    """Allows `rate` events a second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        """Set up a full bucket."""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self) -> bool:
+        """Take a token for an event, if there is one."""
+        now = time.monotonic()
+        refill = (now - self.last) * self.rate
+        self.tokens = min(self.burst, self.tokens + refill)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True